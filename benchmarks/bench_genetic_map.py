@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+import timeit
+
+import msprime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import genetic_map
+
+
+def legacy_create_rate_map(map_file):
+    # The per-line parser the simulation scripts used before genetic_map
+    positions = [0]
+    gmaps = [0]
+    with open(map_file, 'r') as f:
+        for line in f:
+            if line.strip():
+                parts = line.split()
+                positions.append(float(parts[3]))
+                gmaps.append(float(parts[2]))
+
+    combined_rates = []
+    for i in range(1, len(positions)):
+        combination_rate = ((gmaps[i] - gmaps[i - 1]) / (positions[i] - positions[i - 1])) * 1_000_000 * 1e-8
+        combined_rates.append(combination_rate)
+
+    return msprime.RateMap(position=positions, rate=combined_rates)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark genetic map loading')
+    parser.add_argument("-m", '--map', dest="map_file",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plink.chr20.GRCh38.map"),
+                        help="Path to a PLINK genetic map file")
+    parser.add_argument("-r", '--repeat', dest="repeat", type=int, default=5, help="Number of timed repeats")
+    args = parser.parse_args()
+
+    legacy = min(timeit.repeat(lambda: legacy_create_rate_map(args.map_file), number=1, repeat=args.repeat))
+    bulk = min(timeit.repeat(lambda: genetic_map.rate_map_from_plink(args.map_file, cache=False),
+                             number=1, repeat=args.repeat))
+    # First call compiles the cache, the timed calls memory-map it
+    genetic_map.rate_map_from_plink(args.map_file)
+    cached = min(timeit.repeat(lambda: genetic_map.rate_map_from_plink(args.map_file), number=1, repeat=args.repeat))
+
+    print(f"map file:    {args.map_file}")
+    print(f"legacy loop: {legacy * 1000:.1f} ms")
+    print(f"bulk loader: {bulk * 1000:.1f} ms")
+    print(f"cached map:  {cached * 1000:.1f} ms")
+    print(f"speed-up:    {legacy / bulk:.1f}x bulk, {legacy / cached:.1f}x cached")
@@ -0,0 +1,76 @@
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+import arg_needle_lib
+import msprime
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "for_ARG"))
+import get_recombination_nodes
+
+
+def legacy_get_recombination(arg_file):
+    # The per-edge attribute loop get_recombination_nodes.py used before
+    arg = arg_needle_lib.deserialize_arg(arg_file)
+    arg.populate_children_and_roots()
+
+    child_id = []
+    parent_id = []
+    parent_start = []
+    child_height = []
+    parent_height = []
+
+    for i in arg.node_ids():
+        if len(arg.node(i).parent_starts()) != 0:
+            parent_start.extend(arg.node(i).parent_starts())
+            for parent_edge in arg.node(i).parent_edges():
+                child_id.append(parent_edge.child.ID)
+                parent_id.append(parent_edge.parent.ID)
+                child_height.append(parent_edge.child.height)
+                parent_height.append(parent_edge.parent.height)
+
+    return pd.DataFrame({
+        'child_id': np.array(child_id),
+        'parent_id': np.array(parent_id),
+        'parent_height': np.array(parent_height),
+        'child_height': np.array(child_height),
+        'parent_start': np.array(parent_start)
+    })
+
+
+def simulated_argn(path, sample_size, length):
+    ts = msprime.sim_ancestry(samples=sample_size, population_size=10_000, sequence_length=length,
+                              recombination_rate=1e-8, ploidy=2, random_seed=1)
+    arg_needle_lib.serialize_arg(arg_needle_lib.tskit_to_arg(ts), path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark recombination-node extraction from .argn files')
+    parser.add_argument("-a", '--arg', dest="arg_file", default=None,
+                        help="Path to an .argn file; a simulated one is used if omitted")
+    parser.add_argument("-s", '--sample', dest="sample_size", type=int, default=200,
+                        help="Diploid sample size of the simulated ARG")
+    parser.add_argument("-l", '--len', dest="length", type=float, default=5e6, help="Length of the simulated ARG")
+    parser.add_argument("-r", '--repeat', dest="repeat", type=int, default=3, help="Number of timed repeats")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        arg_file = args.arg_file
+        if arg_file is None:
+            arg_file = os.path.join(tmpdir, "bench.argn")
+            simulated_argn(arg_file, args.sample_size, args.length)
+
+        num_edges = len(get_recombination_nodes.get_recombination(arg_file))
+        timings = {
+            "legacy loop": lambda: legacy_get_recombination(arg_file),
+            "preallocated loop": lambda: get_recombination_nodes.get_recombination_loop(arg_file),
+            "bulk extractor": lambda: get_recombination_nodes.get_recombination(arg_file),
+        }
+        print(f"{num_edges} edges")
+        for label, func in timings.items():
+            seconds = min(timeit.repeat(func, number=1, repeat=args.repeat))
+            print(f"{label:18s} {seconds:8.3f} s  {num_edges / seconds:14,.0f} edges/s")
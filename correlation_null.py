@@ -0,0 +1,158 @@
+import argparse
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import genetic_map
+import window_correlation
+
+# Monte Carlo null distributions for the map correlations: how large a
+# (windowed) correlation the binning alone produces when the ARG map carries no
+# information about the true one. Replicates either permute the estimated map
+# bin by bin or rebuild it from randomly drawn blocks of consecutive bins
+# (moving-block bootstrap), which keeps its autocorrelation. Null draws are
+# cached on disk, so repeat analyses of the same map reuse them.
+
+NULL_KINDS = ("permutation", "block")
+
+
+def null_series(x, kind, num_replicates, rng, block_size=10):
+    # (num_replicates, len(x)) matrix of resampled estimated maps
+    x = np.asarray(x, dtype=np.float64)
+    n = len(x)
+    if kind == "permutation":
+        return rng.permuted(np.broadcast_to(x, (num_replicates, n)), axis=1)
+    if kind == "block":
+        block_size = min(block_size, n)
+        num_blocks = -(-n // block_size)
+        starts = rng.integers(0, n - block_size + 1, size=(num_replicates, num_blocks))
+        idx = (starts[:, :, None] + np.arange(block_size)).reshape(num_replicates, -1)[:, :n]
+        return x[idx]
+    raise ValueError(f"Unknown null kind: {kind} (choose from {', '.join(NULL_KINDS)})")
+
+
+def null_statistics(x, y, window_size=None, overlap=False, method="spearman", kind="permutation",
+                    num_replicates=1000, seed=None, block_size=10):
+    # Correlation of each null replicate with y: over the whole map when
+    # window_size is None, else the mean over windows of window_size bins
+    rng = np.random.default_rng(seed)
+    xs = null_series(x, kind, num_replicates, rng, block_size)
+    if window_size is None:
+        window_size, overlap = len(y), False
+    return window_correlation.batch_mean_window_correlation(xs, y, window_size, overlap, method)
+
+
+def _null_chunk(args):
+    return null_statistics(*args)
+
+
+def null_cache_key(x, y, window_size, overlap, method, kind, num_replicates, seed, block_size):
+    # Keyed by the bin count, the window and the maps themselves
+    h = hashlib.sha1()
+    for array in (x, y):
+        h.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+    h.update(repr((len(y), window_size, overlap, method, kind, num_replicates, seed, block_size)).encode())
+    return h.hexdigest()[:16]
+
+
+def null_distribution(x, y, window_size=None, overlap=False, method="spearman", kind="permutation",
+                      num_replicates=1000, seed=42, block_size=10, workers=None, chunk_size=250,
+                      cache_dir=".null_cache"):
+    # num_replicates null statistics, split into chunks run over a process pool
+    # with independent child seeds. Results are stored in cache_dir as .npy
+    # files and loaded from there on later calls with the same inputs.
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if np.isnan(x).any() or np.isnan(y).any():
+        raise ValueError("Null distributions need maps without missing values")
+    cache_file = None
+    if cache_dir is not None:
+        key = null_cache_key(x, y, window_size, overlap, method, kind, num_replicates, seed, block_size)
+        cache_file = os.path.join(cache_dir, f"null_{len(y)}bins_{kind}_{key}.npy")
+        if os.path.exists(cache_file):
+            return np.load(cache_file)
+
+    sizes = [min(chunk_size, num_replicates - lo) for lo in range(0, num_replicates, chunk_size)]
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(x, y, window_size, overlap, method, kind, size, seed_seq, block_size)
+            for size, seed_seq in zip(sizes, seed_seqs)]
+    if workers == 1 or len(jobs) == 1:
+        stats = np.concatenate([_null_chunk(job) for job in jobs])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            stats = np.concatenate(list(pool.map(_null_chunk, jobs)))
+
+    if cache_file is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.save(f, stats)
+        os.replace(tmp_file, cache_file)
+    return stats
+
+
+def empirical_p_value(observed, null):
+    # One-sided: how often the null reaches the observed correlation
+    null = null[~np.isnan(null)]
+    return (1 + np.sum(null >= observed)) / (1 + len(null))
+
+
+def significance_table(x, y, window_sizes, interval_length, overlap=False, method="spearman",
+                       kind="permutation", num_replicates=1000, seed=42, block_size=10, workers=None,
+                       cache_dir=".null_cache"):
+    # Observed correlation against its null, for the whole map and each window size
+    windows = [("Total", None)]
+    windows += list(zip(map(window_correlation.window_label, window_sizes),
+                        window_correlation.window_bins(window_sizes, interval_length)))
+    rows = []
+    for label, bins in windows:
+        if bins is None:
+            observed = window_correlation.total_correlation(x, y, method)
+        else:
+            observed = window_correlation.mean_window_correlation(x, y, bins, overlap, method)
+        null = null_distribution(x, y, bins, overlap, method, kind, num_replicates, seed, block_size,
+                                 workers, cache_dir=cache_dir)
+        rows.append({
+            "Window_Size": label,
+            "Window_Bins": len(y) if bins is None else bins,
+            "Observed": observed,
+            "Null_Mean": np.nanmean(null),
+            "Null_SD": np.nanstd(null),
+            "Null_Q95": np.nanquantile(null, 0.95),
+            "P_Value": empirical_p_value(observed, null),
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Permutation / block-bootstrap significance of map correlations')
+    parser.add_argument("-i", '--input', dest="merged_file", required=True,
+                        help="Merged table with Start, Density and Rate columns (e.g. from rate_estimate.py)")
+    parser.add_argument("-w", '--windows', dest="window_sizes", type=genetic_map.float_list,
+                        default=[10_000, 100_000, 1_000_000], help="Comma-separated window sizes in bp")
+    parser.add_argument('--overlap', action="store_true",
+                        help="Slide windows one bin at a time instead of tiling the map")
+    parser.add_argument("-m", '--method', dest="method", default="spearman", choices=("spearman", "pearson"))
+    parser.add_argument("-k", '--kind', dest="kind", default="permutation", choices=NULL_KINDS,
+                        help="Permute bins, or resample blocks of consecutive bins")
+    parser.add_argument("-b", '--block', dest="block_size", type=int, default=10,
+                        help="Block length in bins for the block bootstrap")
+    parser.add_argument("-n", '--replicates', dest="num_replicates", type=int, default=1000,
+                        help="Number of null replicates")
+    parser.add_argument('--seed', dest="seed", type=int, default=42, help="Root seed for the SeedSequence")
+    parser.add_argument("-j", '--workers', dest="workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument('--cache-dir', dest="cache_dir", default=".null_cache",
+                        help="Directory of cached null distributions")
+    parser.add_argument("-o", '--output', dest="output", default="correlation_null_results.csv",
+                        help="Output CSV")
+    args = parser.parse_args()
+
+    merged = pd.read_csv(args.merged_file)
+    table = significance_table(merged["Density"].to_numpy(), merged["Rate"].to_numpy(), args.window_sizes,
+                               window_correlation.interval_length_of(merged), args.overlap, args.method,
+                               args.kind, args.num_replicates, args.seed, args.block_size, args.workers,
+                               args.cache_dir)
+    table.to_csv(args.output, index=False)
@@ -0,0 +1,229 @@
+import argparse
+import io
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import genetic_map
+
+# Genotype exports that skip the plain-text VCF round trip: a BGZF-compressed
+# VCF written as it streams out of tskit (readable by bcftools/tabix/pyrho
+# without a separate bgzip step), and PLINK2 .pgen/.pvar/.psam written
+# straight from the tree sequence genotype matrix.
+
+GENOTYPE_FORMATS = ("vcf", "vcf.gz", "pgen")
+
+# Largest uncompressed payload per BGZF block, as used by bgzip
+_BGZF_BLOCK_SIZE = 0xff00
+_BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+class BgzfWriter(io.RawIOBase):
+    # Minimal BGZF writer: a series of independent gzip members of at most 64 kB,
+    # each carrying its compressed size in the "BC" extra field, then an EOF block.
+
+    def __init__(self, filename, compresslevel=6):
+        self._handle = open(filename, "wb")
+        self._buffer = bytearray()
+        self._level = compresslevel
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self._buffer += data
+        while len(self._buffer) >= _BGZF_BLOCK_SIZE:
+            self._write_block(bytes(self._buffer[:_BGZF_BLOCK_SIZE]))
+            del self._buffer[:_BGZF_BLOCK_SIZE]
+        return len(data)
+
+    def _write_block(self, block):
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(block) + compressor.flush()
+        bsize = len(cdata) + 25
+        header = struct.pack("<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, bsize)
+        trailer = struct.pack("<2I", zlib.crc32(block) & 0xffffffff, len(block))
+        self._handle.write(header + cdata + trailer)
+
+    def close(self):
+        if self._handle.closed:
+            return
+        if self._buffer:
+            self._write_block(bytes(self._buffer))
+            self._buffer.clear()
+        self._handle.write(_BGZF_EOF)
+        self._handle.close()
+        super().close()
+
+
+def write_vcf_bgzf(mts, vcf_file, compresslevel=6, **vcf_kwargs):
+    # tskit emits the VCF one variant at a time, so it is compressed as it streams
+    with BgzfWriter(vcf_file, compresslevel) as raw:
+        mts.write_vcf(raw, **vcf_kwargs)
+
+
+def _individual_names(mts):
+    # Same default names as tskit's write_vcf
+    return [f"tsk_{j}" for j in range(mts.num_individuals)]
+
+
+def write_pgen(mts, prefix, contig_id="1", block_size=10_000):
+    # Biallelic sites only, matching `plink2 --vcf ... --max-alleles 2 --make-pgen`
+    try:
+        import pgenlib
+    except ImportError as e:
+        raise ImportError("pgenlib is required for .pgen export (pip install pgenlib)") from e
+
+    names = _individual_names(mts)
+    num_haplotypes = mts.num_samples
+    if num_haplotypes != 2 * len(names):
+        raise ValueError("PGEN export expects diploid individuals")
+
+    with open(prefix + ".psam", "w") as psam:
+        psam.write("#IID\tSEX\n")
+        psam.writelines(f"{name}\tNA\n" for name in names)
+
+    positions = np.round(mts.sites_position).astype(np.int64)
+    if len(positions) and positions[0] == 0:
+        raise ValueError("A site is at position 0, which PLINK and VCF cannot represent")
+
+    # The writer needs the exact number of variants up front
+    num_biallelic = sum(len({site.ancestral_state, *(m.derived_state for m in site.mutations)}) == 2
+                        for site in mts.sites())
+    writer = pgenlib.PgenWriter((prefix + ".pgen").encode(), len(names), num_biallelic, False,
+                                hardcall_phase_present=True)
+    block = np.empty((block_size, num_haplotypes), dtype=np.int32)
+    pvar_rows = []
+    filled = 0
+    with open(prefix + ".pvar", "w") as pvar:
+        pvar.write("#CHROM\tPOS\tID\tREF\tALT\n")
+        for variant in mts.variants():
+            if variant.num_alleles != 2:
+                continue
+            block[filled] = variant.genotypes
+            pvar_rows.append(f"{contig_id}\t{positions[variant.site.id]}\t{variant.site.id}\t"
+                             f"{variant.alleles[0]}\t{variant.alleles[1]}\n")
+            filled += 1
+            if filled == block_size:
+                writer.append_alleles_batch(block, all_phased=True)
+                pvar.writelines(pvar_rows)
+                pvar_rows = []
+                filled = 0
+        if filled:
+            writer.append_alleles_batch(block[:filled], all_phased=True)
+            pvar.writelines(pvar_rows)
+    writer.close()
+
+
+def write_genotypes(mts, name, fmt="vcf", contig_id="1"):
+    # name is the output prefix; the extension follows from the format
+    if fmt == "vcf":
+        with open(name + ".vcf", "w") as vcf_out:
+            mts.write_vcf(vcf_out, contig_id=contig_id)
+    elif fmt == "vcf.gz":
+        write_vcf_bgzf(mts, name + ".vcf.gz", contig_id=contig_id)
+    elif fmt == "pgen":
+        write_pgen(mts, name, contig_id=contig_id)
+    else:
+        raise ValueError(f"Unknown genotype format: {fmt}")
+
+
+def genotype_suffixes(fmt):
+    # Files write_genotypes creates next to the prefix
+    if fmt == "pgen":
+        return (".pgen", ".pvar", ".psam")
+    if fmt in GENOTYPE_FORMATS:
+        return ("." + fmt,)
+    raise ValueError(f"Unknown genotype format: {fmt}")
+
+
+# Outputs export_outputs can produce; "genotypes" uses one of GENOTYPE_FORMATS
+OUTPUT_FORMATS = ("argn", "trees", "genotypes", "csv")
+# The outputs that need only the tree sequence, not the rate map
+TREE_OUTPUT_FORMATS = ("argn", "trees", "genotypes")
+# Per-format seconds in the run logs, from export_outputs' timings
+TIMING_COLUMNS = tuple(f"export_{fmt}_seconds" for fmt in OUTPUT_FORMATS)
+
+
+def write_argn(mts, name):
+    import arg_needle_lib
+    arg = arg_needle_lib.tskit_to_arg(mts)
+    arg_needle_lib.serialize_arg(arg, name + ".argn")
+
+
+def write_rates_csv(name, positions, rates):
+    # Position,Rate table; the last position only closes the final interval
+    genetic_map.write_rate_table(name + ".csv", positions, rates)
+
+
+def _timed(func, *args):
+    t0 = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - t0
+
+
+def export_outputs(mts, name, formats=OUTPUT_FORMATS, genotype_format="vcf", positions=None, rates=None,
+                   workers=None, argn_in_process=False, contig_id="1"):
+    # Run the requested writers concurrently and return {format: seconds}.
+    # Each writer only reads mts, so they can share it across threads; the argn
+    # conversion can instead go to a separate process (mts is pickled over).
+    jobs = {}
+    for fmt in formats:
+        if fmt == "argn":
+            jobs[fmt] = (write_argn, mts, name)
+        elif fmt == "trees":
+            jobs[fmt] = (mts.dump, name + ".trees")
+        elif fmt == "genotypes":
+            jobs[fmt] = (write_genotypes, mts, name, genotype_format, contig_id)
+        elif fmt == "csv":
+            if positions is None or rates is None:
+                raise ValueError("csv output needs the map positions and rates")
+            jobs[fmt] = (write_rates_csv, name, positions, rates)
+        else:
+            raise ValueError(f"Unknown output format: {fmt}")
+
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers or len(jobs) or 1) as threads:
+        process_pool = ProcessPoolExecutor(max_workers=1) if argn_in_process and "argn" in jobs else None
+        try:
+            for fmt, job in jobs.items():
+                pool = process_pool if fmt == "argn" and process_pool is not None else threads
+                futures[fmt] = pool.submit(_timed, *job)
+            return {fmt: future.result() for fmt, future in futures.items()}
+        finally:
+            if process_pool is not None:
+                process_pool.shutdown()
+
+
+def append_log_row(log_file, row, columns):
+    # One result per line under a fixed header; rows without some of the
+    # columns (exports skipped or not requested) leave them empty
+    pd.DataFrame([row]).reindex(columns=columns).to_csv(log_file, mode="a", index=False,
+                                                       header=not os.path.exists(log_file))
+
+
+def parse_formats(value, allowed=OUTPUT_FORMATS):
+    formats = [fmt.strip() for fmt in value.split(",") if fmt.strip()]
+    if not formats:
+        raise ValueError("No output formats given")
+    for fmt in formats:
+        if fmt not in allowed:
+            raise ValueError(f"Unknown output format: {fmt} (choose from {', '.join(allowed)})")
+    return formats
+
+
+def formats_type(allowed):
+    # parse_formats as an argparse type, limited to the outputs a script can write
+    def formats(value):
+        try:
+            return parse_formats(value, allowed)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e)) from e
+    return formats
@@ -1,5 +1,8 @@
-import arg_needle_lib
 import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import numpy as np
 import pandas as pd
 
@@ -8,48 +11,174 @@ import pandas as pd
 #arg.populate_children_and_roots()
 
 
-def get_recombination(arg_file):
+def read_argn_edges(arg_file):
+   # Read the edge and node tables straight out of the .argn (HDF5) file
+   import h5py
+   with h5py.File(arg_file, "r") as f:
+       edge_ids = f["edge_ids"][:]
+       parent_start = f["edge_ranges"][:, 0]
+       heights = f["times"][:]
+   return edge_ids[:, 0], edge_ids[:, 1], parent_start, heights
+
+
+def read_tskit_edges(ts):
+   # Exact ARGs: the tskit edge table holds the same edges tskit_to_arg would
+   # serialize, so read them without the .argn round trip. ts may be a
+   # TreeSequence already in memory or a path to a .trees file.
+   import tskit
+   if not isinstance(ts, tskit.TreeSequence):
+       ts = tskit.load(ts)
+   edges = ts.tables.edges
+   return edges.child, edges.parent, edges.left, ts.tables.nodes.time
+
+
+def get_recombination_loop(arg_file):
+   # Walk the deserialized ARG, filling preallocated arrays one parent edge at a time
+   import arg_needle_lib
    arg = arg_needle_lib.deserialize_arg(arg_file)
    arg.populate_children_and_roots()
 
-   child_id = []
-   parent_id = []
-   parent_start = []
-   child_height = []
-   parent_height = []
+   num_edges = arg.num_edges()
+   child_id = np.empty(num_edges, dtype=np.int32)
+   parent_id = np.empty(num_edges, dtype=np.int32)
+   parent_start = np.empty(num_edges, dtype=np.float64)
+   heights = np.empty(arg.num_nodes(), dtype=np.float64)
 
+   k = 0
    for i in arg.node_ids():
-       # Find all non-root nodes
-       if len(arg.node(i).parent_starts()) != 0:
-           parent_start.extend(arg.node(i).parent_starts())
-           for parent_edge in arg.node(i).parent_edges():
-               child_id.append(parent_edge.child.ID)
-               parent_id.append(parent_edge.parent.ID)
-               child_height.append(parent_edge.child.height)
-               parent_height.append(parent_edge.parent.height)
-    
-   df = pd.DataFrame({
-          'child_id': np.array(child_id), 
-          'parent_id': np.array(parent_id),
-          'parent_height': np.array(parent_height),
-          'child_height': np.array(child_height),
-          'parent_start': np.array(parent_start)
-          })
-   return(df)
-   
+       node = arg.node(i)
+       heights[i] = node.height
+       edges = node.parent_edges()
+       n = len(edges)
+       if n != 0:
+           child_id[k:k + n] = i
+           parent_id[k:k + n] = [edge.parent.ID for edge in edges]
+           parent_start[k:k + n] = node.parent_starts()
+           k += n
+   return child_id[:k], parent_id[:k], parent_start[:k], heights
+
+
+def get_recombination_arrays(arg_file):
+   # One row per parent edge, ordered by child and then start position.
+   # arg_file is an .argn file, a .trees file or an in-memory tree sequence.
+   if not isinstance(arg_file, str) or arg_file.endswith(".trees"):
+       child_id, parent_id, parent_start, heights = read_tskit_edges(arg_file)
+   else:
+       try:
+           child_id, parent_id, parent_start, heights = read_argn_edges(arg_file)
+       except (ImportError, KeyError):
+           # No h5py, or an .argn layout without these datasets
+           child_id, parent_id, parent_start, heights = get_recombination_loop(arg_file)
+
+   order = np.lexsort((parent_start, child_id))
+   child_id = child_id[order]
+   parent_id = parent_id[order]
+   return {
+       'child_id': child_id,
+       'parent_id': parent_id,
+       'parent_height': heights[parent_id],
+       'child_height': heights[child_id],
+       'parent_start': parent_start[order],
+   }
+
+
+def get_recombination(arg_file):
+   return pd.DataFrame(get_recombination_arrays(arg_file))
+
+
+# Column types for the Parquet output
+NODE_DTYPES = {
+    'child_id': np.int32,
+    'parent_id': np.int32,
+    'parent_height': np.float32,
+    'child_height': np.float32,
+    'parent_start': np.float64,
+}
 
 
+def write_recombination(nodes, output, fmt="csv", recombinations_only=False):
+   # recombinations_only drops the parent_start == 0 rows every analysis script filters out
+   if recombinations_only:
+       nodes = nodes[nodes['parent_start'] != 0]
+   if fmt == "parquet":
+       # Needs pyarrow (or fastparquet)
+       nodes.astype(NODE_DTYPES).to_parquet(output + ".parquet", index=False, compression="zstd")
+   elif fmt == "csv":
+       nodes.to_csv(output + ".csv", index=False)
+   else:
+       raise ValueError(f"Unknown output format: {fmt}")
+
+
+def output_path(output, fmt):
+   return output + (".parquet" if fmt == "parquet" else ".csv")
+
+
+def is_up_to_date(arg_file, output, fmt):
+   out = output_path(output, fmt)
+   return os.path.exists(out) and os.path.getmtime(out) >= os.path.getmtime(arg_file)
+
+
+def process_one(arg_file, output, fmt="csv", recombinations_only=False):
+   nodes = get_recombination(arg_file)
+   write_recombination(nodes, output, fmt, recombinations_only)
+   return arg_file, output_path(output, fmt), len(nodes)
+
+
+def expand_inputs(patterns):
+   # Shell-style globs are expanded here so quoted patterns work too
+   files = []
+   for pattern in patterns:
+       matches = sorted(glob.glob(pattern))
+       files.extend(matches if matches else [pattern])
+   return files
+
+
+def pair_outputs(arg_files, outputs):
+   # Either one output per input, or a single template with {name} (the input
+   # file name without its extension)
+   if len(outputs) == len(arg_files):
+       return list(outputs)
+   if len(outputs) == 1 and "{name}" in outputs[0]:
+       return [outputs[0].format(name=os.path.splitext(os.path.basename(f))[0]) for f in arg_files]
+   raise ValueError("Give one output per input, or a single output template containing {name}")
+
+
+def process_batch(arg_files, outputs, fmt="csv", recombinations_only=False, workers=None, force=False):
+   # Each file is handled by a worker in this interpreter's pool; inputs whose
+   # outputs are newer than them are skipped unless force is set
+   jobs = []
+   for a, o in zip(arg_files, outputs):
+       if not force and is_up_to_date(a, o, fmt):
+           print(f"Skipping {a}: {output_path(o, fmt)} is up to date")
+           continue
+       jobs.append((a, o))
+   if len(jobs) <= 1 or workers == 1:
+       for a, o in jobs:
+           yield process_one(a, o, fmt, recombinations_only)
+       return
+   with ProcessPoolExecutor(max_workers=workers) as pool:
+       futures = [pool.submit(process_one, a, o, fmt, recombinations_only) for a, o in jobs]
+       for future in as_completed(futures):
+           yield future.result()
+
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='Simulate trees')
-    parser.add_argument("-a", '--arg', dest="arg_file", required=True, help="Number of haploid samples, which is not the same as the diploid sample size required by msprime")
-    parser.add_argument("-o", '--output', dest="output", required=True)
+    parser = argparse.ArgumentParser(description='Extract recombination nodes from ARGs')
+    parser.add_argument("-a", '--arg', dest="arg_files", required=True, nargs="+",
+                        help="Paths or globs of .argn files, or .trees files for exact ARGs")
+    parser.add_argument("-o", '--output', dest="outputs", required=True, nargs="+",
+                        help="Output prefix per input, or one template containing {name}")
+    parser.add_argument("-f", '--format', dest="format", default="csv", choices=["csv", "parquet"],
+                        help="Output table format; parquet stores int32 IDs and float32 heights")
+    parser.add_argument('--recombinations-only', dest="recombinations_only", action="store_true",
+                        help="Drop rows with parent_start == 0 when writing")
+    parser.add_argument("-j", '--workers', dest="workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument('--force', action="store_true", help="Rebuild outputs even if they are up to date")
     
     args = vars(parser.parse_args())
-    arg_file = args['arg_file']
-    output = args['output']
-
-    nrecomb = get_recombination(arg_file)
-    nrecomb.to_csv(output + ".csv", index=False)
-
+    arg_files = expand_inputs(args['arg_files'])
+    outputs = pair_outputs(arg_files, args['outputs'])
 
+    for arg_file, output, num_rows in process_batch(arg_files, outputs, args['format'], args['recombinations_only'],
+                                                     args['workers'], args['force']):
+        print(f"Completed {arg_file} -> {output} ({num_rows} edges)")
@@ -5,85 +5,77 @@ import argparse
 import gzip
 import arg_needle_lib
 import csv
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import genetic_map
+import export
+import mutation_overlay
 #import timeancestry as tac
 
 def create_rate_map(map_file):
-    # Initialize lists to store positions and rates
-    positions = [0]
-    gmaps = [0]
-
-    # Read positions from map.txt file
-    with open(map_file, 'r') as f:
-        for line in f:
-            if line.strip():  # Check if line is not empty
-                parts = line.split()
-                position = float(parts[3])  # Extract position (assuming it's the third column)
-                positions.append(position)
-                gmap = float(parts[2])
-                gmaps.append(gmap)
-
-    # Calculate combination rates and record them
-    combined_rates = []
-    for i in range(1, len(positions)):
-        pos1 = positions[i - 1]
-        pos2 = positions[i]
-        gmap1 = gmaps[i - 1]
-        gmap2 = gmaps[i]
-        combination_rate = ((gmap2 - gmap1) / (pos2 - pos1)) * 1_000_000 * 1e-8
-        combined_rates.append(combination_rate)
-    
-    rate_map = msprime.RateMap(
-        position=positions,
-        rate=combined_rates
-    )
+    # Bulk-load the PLINK map and compute the rates with array differences
+    rate_map, positions, combined_rates = genetic_map.rate_map_from_plink(map_file)
 
-    with open("recombination_rates_chr1.csv", "w", newline='') as csvfile:
-        writer = csv.writer(csvfile)
-    
-        # Write header
-        writer.writerow(["Position", "Rate"])
-    
-        # Write data rows
-        for i in range(len(positions)-1):
-            writer.writerow([positions[i], combined_rates[i]])
+    genetic_map.write_rate_table("recombination_rates_chr1.csv", positions, combined_rates)
     
     return rate_map
 
 
-def export_output(mts, name):
-    a = arg_needle_lib.tskit_to_arg(mts)
-    arg_needle_lib.serialize_arg(a, name + ".argn")
+def export_output(mts, name, genotype_format="vcf", formats=("argn", "trees", "genotypes")):
+    # Write the .argn, .trees and genotypes concurrently
+    timings = export.export_outputs(mts, name, formats, genotype_format)
+    for fmt, seconds in timings.items():
+        print(f"Exported {fmt} in {seconds:.2f}s")
 
-    # Output Tree Sequence to a file
-    mts.dump(name + ".trees")
-
-    # Output VCF (Variant Call Format) file
-    vcf_file = name + ".vcf"
-    with open(vcf_file, "w") as vcf_out:
-        mts.write_vcf(vcf_out)
-
-def sim_one_const(pop_size, sample_size, rate_map, mu_rate):
+def sim_ancestry_const(pop_size, sample_size, rate_map):
     # Create a demographic model for a constant-size population
     demographic_model = msprime.Demography()
     demographic_model.add_population(initial_size=pop_size)
     
     # Simulate the tree sequence
-    ts = msprime.sim_ancestry(samples=sample_size, demography=demographic_model, recombination_rate=rate_map,
-                              ploidy=2)
+    return msprime.sim_ancestry(samples=sample_size, demography=demographic_model, recombination_rate=rate_map,
+                                ploidy=2)
+
+def sim_one_const(pop_size, sample_size, rate_map, mu_rate):
+    ts = sim_ancestry_const(pop_size, sample_size, rate_map)
     
     # Simulate mutations
     mts = msprime.sim_mutations(ts, rate= mu_rate)
     
     return mts
 
+def sim_overlays(pop_size, sample_size, rate_map, mu_rates, seeds, name, genotype_format="vcf",
+                 formats=("argn", "trees", "genotypes"), workers=None):
+    # One ancestry simulation, then a mutated copy per (rate, seed) pair,
+    # exported in parallel as <name>_mu<rate>_seed<seed>.*
+    ts = sim_ancestry_const(pop_size, sample_size, rate_map)
+    ancestry_file = name + "_ancestry.trees"
+    ts.dump(ancestry_file)
+    tasks = mutation_overlay.make_overlay_tasks(mu_rates, seeds, name, formats, genotype_format)
+    for result in mutation_overlay.run_overlays(ancestry_file, tasks, workers, log_file=name + "_overlays.csv"):
+        print(f"Exported {result['name']} ({result['num_sites']} sites) in {result['seconds']:.2f}s")
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Simulate trees')
     parser.add_argument("-s", '--sample', dest="sample_size", required=True, help="Number of haploid samples, which is not the same as the diploid sample size required by msprime")
     #parser.add_argument("-l", '--len', dest="len", required=True, help="Length of the sequence")
     parser.add_argument("-p", '--pop', dest="pop_size", required=True, help="Effective population size")
-    parser.add_argument("-mu", '--mutation', dest="mu_rate", required=True, help="Mutation rate")
+    parser.add_argument("-mu", '--mutation', dest="mu_rate", required=True,
+                        help="Mutation rate, or comma-separated rates overlaid on one ancestry simulation")
+    parser.add_argument('--mutation-seeds', dest="mutation_seeds", type=genetic_map.int_list, default=None,
+                        help="Comma-separated mutation seeds; with several rates or seeds the ancestry is simulated "
+                             "once and every (rate, seed) pair is written as <output>_mu<rate>_seed<seed>")
+    parser.add_argument("-j", '--workers', dest="workers", type=int, default=None,
+                        help="Worker processes for the mutation overlays")
     parser.add_argument("-m", '--map', dest="map_file", required=True, help="Path to the genetic map file")
     parser.add_argument("-o", '--output', dest="output", required=True, help="Output file prefix")
+    parser.add_argument("-g", '--genotypes', dest="genotype_format", default="vcf", choices=export.GENOTYPE_FORMATS,
+                        help="Genotype output: plain VCF, BGZF-compressed VCF or PLINK2 pgen/pvar/psam")
+    parser.add_argument("-f", '--formats', dest="formats", default="argn,trees,genotypes",
+                        type=export.formats_type(export.TREE_OUTPUT_FORMATS),
+                        help="Comma-separated outputs to write, from: argn, trees, genotypes")
     
     args = vars(parser.parse_args())
     print(args)
@@ -91,10 +83,14 @@ if __name__ == '__main__':
     pop_size = int(args['pop_size'])
     sample_size = int(args['sample_size'])
     #length = int(args['len'])
-    mu_rate = float(args['mu_rate'])
+    mu_rates = genetic_map.float_list(args['mu_rate'])
     map_file = args['map_file']
     
     rate_map = create_rate_map(map_file)
-    mts = sim_one_const(pop_size, sample_size, rate_map, mu_rate)
-    export_output(mts, args['output'])
+    if len(mu_rates) == 1 and args['mutation_seeds'] is None:
+        mts = sim_one_const(pop_size, sample_size, rate_map, mu_rates[0])
+        export_output(mts, args['output'], args['genotype_format'], args['formats'])
+    else:
+        sim_overlays(pop_size, sample_size, rate_map, mu_rates, args['mutation_seeds'] or [1], args['output'],
+                     args['genotype_format'], args['formats'], args['workers'])
 
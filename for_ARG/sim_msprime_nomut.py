@@ -5,62 +5,28 @@ import argparse
 import gzip
 import arg_needle_lib
 import csv
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import genetic_map
+import export
 #import timeancestry as tac
 
 def create_rate_map(map_file):
-    # Initialize lists to store positions and rates
-    positions = [0]
-    gmaps = [0]
-
-    # Read positions from map.txt file
-    with open(map_file, 'r') as f:
-        for line in f:
-            if line.strip():  # Check if line is not empty
-                parts = line.split()
-                position = float(parts[3])  # Extract position (assuming it's the third column)
-                positions.append(position)
-                gmap = float(parts[2])
-                gmaps.append(gmap)
-
-    # Calculate combination rates and record them
-    combined_rates = []
-    for i in range(1, len(positions)):
-        pos1 = positions[i - 1]
-        pos2 = positions[i]
-        gmap1 = gmaps[i - 1]
-        gmap2 = gmaps[i]
-        combination_rate = ((gmap2 - gmap1) / (pos2 - pos1)) * 1_000_000 * 1e-8
-        combined_rates.append(combination_rate)
-    
-    rate_map = msprime.RateMap(
-        position=positions,
-        rate=combined_rates
-    )
+    # Bulk-load the PLINK map and compute the rates with array differences
+    rate_map, positions, combined_rates = genetic_map.rate_map_from_plink(map_file)
 
-    with open("recombination_rates.csv", "w", newline='') as csvfile:
-        writer = csv.writer(csvfile)
-    
-        # Write header
-        writer.writerow(["Position", "Rate"])
-    
-        # Write data rows
-        for i in range(len(positions)-1):
-            writer.writerow([positions[i], combined_rates[i]])
+    genetic_map.write_rate_table("recombination_rates.csv", positions, combined_rates)
     
     return rate_map
 
 
-def export_output(ts, name):
-    a = arg_needle_lib.tskit_to_arg(ts)
-    arg_needle_lib.serialize_arg(a, name + ".argn")
-
-    # Output Tree Sequence to a file
-    ts.dump(name + ".trees")
-
-    # Output VCF (Variant Call Format) file
-    vcf_file = name + ".vcf"
-    with open(vcf_file, "w") as vcf_out:
-        ts.write_vcf(vcf_out)
+def export_output(ts, name, genotype_format="vcf", formats=("argn", "trees", "genotypes")):
+    # Write the .argn, .trees and genotypes concurrently
+    timings = export.export_outputs(ts, name, formats, genotype_format)
+    for fmt, seconds in timings.items():
+        print(f"Exported {fmt} in {seconds:.2f}s")
 
 def sim_one_const(pop_size, sample_size, rate_map):
     # Create a demographic model for a constant-size population
@@ -84,6 +50,11 @@ if __name__ == '__main__':
     #parser.add_argument("-mu", '--mutation', dest="mu_rate", required=True, help="Mutation rate")
     parser.add_argument("-m", '--map', dest="map_file", required=True, help="Path to the genetic map file")
     parser.add_argument("-o", '--output', dest="output", required=True, help="Output file prefix")
+    parser.add_argument("-g", '--genotypes', dest="genotype_format", default="vcf", choices=export.GENOTYPE_FORMATS,
+                        help="Genotype output: plain VCF, BGZF-compressed VCF or PLINK2 pgen/pvar/psam")
+    parser.add_argument("-f", '--formats', dest="formats", default="argn,trees,genotypes",
+                        type=export.formats_type(export.TREE_OUTPUT_FORMATS),
+                        help="Comma-separated outputs to write, from: argn, trees, genotypes")
     
     args = vars(parser.parse_args())
     print(args)
@@ -96,5 +67,5 @@ if __name__ == '__main__':
     
     rate_map = create_rate_map(map_file)
     mts = sim_one_const(pop_size, sample_size, rate_map)
-    export_output(mts, args['output'])
+    export_output(mts, args['output'], args['genotype_format'], args['formats'])
 
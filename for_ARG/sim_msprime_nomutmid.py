@@ -6,22 +6,19 @@ import gzip
 import arg_needle_lib
 import csv
 import random
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import genetic_map
+import export
 #import timeancestry as tac
 
 def create_rate_map(map_file):
-    # Initialize lists to store positions and rates
-    positions = [0]
-    gmaps = [0]
-
-    # Read positions from map.txt file
-    with open(map_file, 'r') as f:
-        for line in f:
-            if line.strip():  # Check if line is not empty
-                parts = line.split()
-                position = float(parts[3])  # Extract position (assuming it's the third column)
-                positions.append(position)
-                gmap = float(parts[2])
-                gmaps.append(gmap)
+    # Read positions and genetic positions from the compiled map cache
+    positions, gmaps = genetic_map.load_map_arrays(map_file, "plink")
+    positions = np.insert(positions, 0, 0)
+    gmaps = np.insert(gmaps, 0, 0)
 
     ## random 500kb segement
     # Ensure there is enough data for a 500kb segment
@@ -33,57 +30,33 @@ def create_rate_map(map_file):
     start_position = random.uniform(positions[0], max_start_position)
     end_position = start_position + 500_000
 
-    # Filter positions and rates to only include the middle 500kb
-    filtered_positions = []
-    filtered_gmaps = []
-    for pos, gmap in zip(positions, gmaps):
-        if start_position <= pos <= end_position:
-            filtered_positions.append(pos)
-            filtered_gmaps.append(gmap)
+    # Slice the positions inside the 500kb window by binary search
+    window = genetic_map.window_slice(positions, start_position, end_position)
+    filtered_positions = positions[window]
+    filtered_gmaps = gmaps[window]
 
     # Normalize positions to ensure the first position is zero
-    normalized_positions = [pos - filtered_positions[0] for pos in filtered_positions]
+    normalized_positions = filtered_positions - filtered_positions[0]
 
-    # Calculate combination rates and record them
-    combined_rates = []
-    for i in range(1, len(normalized_positions)):
-        pos1 = normalized_positions[i - 1]
-        pos2 = normalized_positions[i]
-        gmap1 = filtered_gmaps[i - 1]
-        gmap2 = filtered_gmaps[i]
-        combination_rate = ((gmap2 - gmap1) / (pos2 - pos1)) * 1_000_000 * 1e-8
-        combined_rates.append(combination_rate)
+    # Calculate combination rates from array differences
+    combined_rates = genetic_map.compute_rates(normalized_positions, filtered_gmaps)
 
     rate_map = msprime.RateMap(
         position=normalized_positions,
         rate=combined_rates
     )
 
-    with open("recombination_rates_chr1mid.csv", "w", newline='') as csvfile:
-        writer = csv.writer(csvfile)
-    
-        # Write header
-        writer.writerow(["Position", "Rate"])
-    
-        # Write data rows
-        for i in range(len(normalized_positions) - 1):
-            writer.writerow([normalized_positions[i], combined_rates[i]])
+    genetic_map.write_rate_table("recombination_rates_chr1mid.csv", normalized_positions, combined_rates)
     
     return rate_map
 
 
 
-def export_output(ts, name):
-    a = arg_needle_lib.tskit_to_arg(ts)
-    arg_needle_lib.serialize_arg(a, name + ".argn")
-
-    # Output Tree Sequence to a file
-    ts.dump(name + ".trees")
-
-    # Output VCF (Variant Call Format) file
-    vcf_file = name + ".vcf"
-    with open(vcf_file, "w") as vcf_out:
-        ts.write_vcf(vcf_out)
+def export_output(ts, name, genotype_format="vcf", formats=("argn", "trees", "genotypes")):
+    # Write the .argn, .trees and genotypes concurrently
+    timings = export.export_outputs(ts, name, formats, genotype_format)
+    for fmt, seconds in timings.items():
+        print(f"Exported {fmt} in {seconds:.2f}s")
 
 def sim_one_const(pop_size, sample_size, rate_map):
     # Create a demographic model for a constant-size population
@@ -107,6 +80,11 @@ if __name__ == '__main__':
     #parser.add_argument("-mu", '--mutation', dest="mu_rate", required=True, help="Mutation rate")
     parser.add_argument("-m", '--map', dest="map_file", required=True, help="Path to the genetic map file")
     parser.add_argument("-o", '--output', dest="output", required=True, help="Output file prefix")
+    parser.add_argument("-g", '--genotypes', dest="genotype_format", default="vcf", choices=export.GENOTYPE_FORMATS,
+                        help="Genotype output: plain VCF, BGZF-compressed VCF or PLINK2 pgen/pvar/psam")
+    parser.add_argument("-f", '--formats', dest="formats", default="argn,trees,genotypes",
+                        type=export.formats_type(export.TREE_OUTPUT_FORMATS),
+                        help="Comma-separated outputs to write, from: argn, trees, genotypes")
     
     args = vars(parser.parse_args())
     print(args)
@@ -119,5 +97,5 @@ if __name__ == '__main__':
     
     rate_map = create_rate_map(map_file)
     mts = sim_one_const(pop_size, sample_size, rate_map)
-    export_output(mts, args['output'])
+    export_output(mts, args['output'], args['genotype_format'], args['formats'])
 
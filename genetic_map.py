@@ -0,0 +1,337 @@
+import glob
+import hashlib
+import os
+import random
+
+import msprime
+import numpy as np
+import pandas as pd
+
+# Shared loaders for the genetic maps used by the simulation scripts.
+# Every file is read in one bulk pass into NumPy arrays and the rates are
+# computed with array differences instead of per-line Python loops.
+
+# Convert cM/bp to the per-bp, per-generation rate msprime expects
+CM_TO_RATE = 1_000_000 * 1e-8
+
+
+def read_plink_map(map_file):
+    # PLINK .map: chromosome, SNP id, genetic position (cM), physical position (bp)
+    df = pd.read_csv(map_file, sep=r"\s+", header=None, usecols=[2, 3],
+                     names=["cM", "Position"], dtype={"cM": np.float64, "Position": np.float64},
+                     skip_blank_lines=True)
+    return df["Position"].to_numpy(), df["cM"].to_numpy()
+
+
+def read_hapmap(map_file, position_col=1, map_col=3):
+    # HapMap: header line, then chromosome, position (bp), rate (cM/Mb), map (cM)
+    df = pd.read_csv(map_file, sep=r"\s+", header=0, usecols=[position_col, map_col])
+    return df.iloc[:, 0].to_numpy(np.float64), df.iloc[:, 1].to_numpy(np.float64)
+
+
+def read_rate_csv(csv_file):
+    # The "Position,Rate" tables written next to each simulation
+    df = pd.read_csv(csv_file, dtype={"Position": np.float64, "Rate": np.float64})
+    return df["Position"].to_numpy(), df["Rate"].to_numpy()
+
+
+_READERS = {
+    "plink": read_plink_map,
+    "hapmap": read_hapmap,
+    "csv": read_rate_csv,
+}
+
+
+def guess_format(map_file):
+    if map_file.endswith(".csv"):
+        return "csv"
+    if map_file.endswith(".txt") or "hapmap" in map_file:
+        return "hapmap"
+    return "plink"
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Directory for the compiled maps of every source, e.g. when the map
+# directories are read-only; by default they go next to each source
+MAP_CACHE_ENV = "MAP_CACHE_DIR"
+
+
+def map_cache_path(map_file, fmt, cache_dir=None):
+    # Compiled maps live in .map_cache/ next to the source (or in cache_dir, or
+    # $MAP_CACHE_DIR, under a subdirectory per source directory), keyed by the
+    # source's content hash
+    source_dir = os.path.dirname(os.path.abspath(map_file))
+    if cache_dir is None:
+        cache_dir = os.environ.get(MAP_CACHE_ENV)
+    if cache_dir is None:
+        cache_dir = os.path.join(source_dir, ".map_cache")
+    else:
+        cache_dir = os.path.join(cache_dir, hashlib.sha1(source_dir.encode()).hexdigest()[:16])
+    name = os.path.basename(map_file)
+    return os.path.join(cache_dir, f"{name}.{fmt}.{file_digest(map_file)[:16]}.npy")
+
+
+def load_map_arrays(map_file, fmt=None, cache=True, cache_dir=None):
+    # Return the two columns of a map file (position and cM, or position and rate).
+    # With caching on, the first call compiles them to a raw (n, 2) float64 .npy file
+    # and later calls memory-map it; the cache is rebuilt when the source changes.
+    # When the cache directory cannot be written the map is read directly.
+    if fmt is None:
+        fmt = guess_format(map_file)
+    if not cache:
+        return _READERS[fmt](map_file)
+
+    cache_file = map_cache_path(map_file, fmt, cache_dir)
+    if not os.path.exists(cache_file):
+        first, second = _READERS[fmt](map_file)
+        try:
+            _compile_map(map_file, fmt, cache_file, first, second)
+        except OSError:
+            return first, second
+
+    data = np.load(cache_file, mmap_mode="r")
+    return data[:, 0], data[:, 1]
+
+
+def _compile_map(map_file, fmt, cache_file, first, second):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    # Drop compiled copies of older versions of the same source; another
+    # process may be writing (or removing) them at the same time
+    current = cache_file[:-len(".npy")]
+    for stale in glob.glob(cache_file.rsplit(".", 2)[0] + ".*.npy"):
+        if stale.startswith(current):
+            continue
+        try:
+            os.remove(stale)
+        except FileNotFoundError:
+            pass
+    _save_array(cache_file, np.column_stack([first, second]).astype(np.float64))
+    if fmt == "plink":
+        _save_array(_offsets_path(cache_file), plink_row_offsets(map_file))
+
+
+def _save_array(path, array):
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_file, path)
+
+
+def _offsets_path(cache_file):
+    return cache_file[:-len(".npy")] + ".offsets.npy"
+
+
+def plink_row_offsets(map_file):
+    # Byte offset of each row read_plink_map reads, then the end of the last row
+    offsets = []
+    end = position = 0
+    with open(map_file, "rb") as f:
+        for line in f:
+            if len(line.split()) >= 4:
+                offsets.append(position)
+                end = position + len(line)
+            position += len(line)
+    offsets.append(end)
+    return np.array(offsets, dtype=np.int64)
+
+
+def load_row_offsets(map_file, cache=True, cache_dir=None):
+    # plink_row_offsets, compiled next to the map's .npy by load_map_arrays
+    if not cache:
+        return plink_row_offsets(map_file)
+    offsets_file = _offsets_path(map_cache_path(map_file, "plink", cache_dir))
+    if not os.path.exists(offsets_file):
+        try:
+            os.makedirs(os.path.dirname(offsets_file), exist_ok=True)
+            _save_array(offsets_file, plink_row_offsets(map_file))
+        except OSError:
+            return plink_row_offsets(map_file)
+    return np.load(offsets_file, mmap_mode="r")
+
+
+def window_slice(positions, start, end):
+    # Index range of the sorted positions inside [start, end], found by binary search
+    lo = np.searchsorted(positions, start, side="left")
+    hi = np.searchsorted(positions, end, side="right")
+    return slice(lo, hi)
+
+
+def extract_window(positions, values, start, length):
+    window = window_slice(positions, start, start + length)
+    return positions[window], values[window]
+
+
+def random_window_starts(positions, length, size=None, rng=None):
+    # Uniform start positions that leave room for a full window
+    if positions[-1] - positions[0] < length:
+        raise ValueError(f"Not enough data for a {length} bp segment.")
+    rng = np.random.default_rng(rng)
+    return rng.uniform(positions[0], positions[-1] - length, size)
+
+
+def window_bounds(positions, starts, length):
+    # Vectorised window_slice for many windows at once: returns lo and hi index arrays
+    starts = np.asarray(starts)
+    lo = np.searchsorted(positions, starts, side="left")
+    hi = np.searchsorted(positions, starts + length, side="right")
+    return lo, hi
+
+
+def rate_map_window(rate_map, length, rng=random):
+    # Pick a random interval start strictly inside the map that leaves room for
+    # `length` bp, and the last interval end before start + length. Same draws as
+    # random.choice over the candidate starts, without building the list.
+    left = rate_map.left
+    right = rate_map.right
+    if right[-1] - right[0] < length:
+        raise ValueError(f"Not enough data for a {length} bp segment.")
+    lo = np.searchsorted(left, right[0], side="right")
+    hi = np.searchsorted(left, right[-1] - length, side="left")
+    start_position = left[rng.randrange(lo, hi)]
+    end_position = right[np.searchsorted(right, start_position + length, side="left") - 1]
+    return start_position, end_position
+
+
+def write_plink_window(source_map, map_file, window, cache=True, cache_dir=None):
+    # Rows `window` (a slice of load_map_arrays' rows) of a PLINK map copied
+    # as they are, keeping its chromosome column and separators. The compiled
+    # row offsets give the byte range, so only the window is read.
+    offsets = load_row_offsets(source_map, cache, cache_dir)
+    start, stop, _ = window.indices(len(offsets) - 1)
+    start, stop = int(offsets[start]), int(offsets[max(start, stop)])
+    with open(source_map, "rb") as src, open(map_file, "wb") as f:
+        src.seek(start)
+        f.write(src.read(stop - start))
+
+
+def cumulative_map(positions, rates, scale=100, decimals=6):
+    # Genetic position at each point, summing rate * distance over the intervals
+    # before it and rounding to `decimals` places as the per-line loops did
+    positions = np.asarray(positions)
+    distances = np.asarray(rates[:len(positions) - 1]) * np.diff(positions) * scale
+    return np.concatenate([[0], np.round(np.cumsum(distances), decimals)])
+
+
+def _as_list(values):
+    # Plain Python numbers, so each float prints as its repr
+    return values.tolist() if isinstance(values, np.ndarray) else list(values)
+
+
+def write_rate_table(csv_file, positions, rates):
+    # Position,Rate CSV with one row per rate, in csv.writer's format
+    n = len(rates)
+    with open(csv_file, "w", newline="") as f:
+        f.write("Position,Rate\r\n")
+        f.write("".join(map("{},{}\r\n".format, _as_list(positions[:n]), _as_list(rates))))
+
+
+def write_map_text(map_file, positions, gmaps, chromosome=22):
+    # chromosome, ".", genetic position, physical position; values printed in full
+    row = f"{chromosome}\t.\t{{}}\t{{}}\n"
+    with open(map_file, "w") as f:
+        f.write("".join(map(row.format, _as_list(gmaps), _as_list(positions))))
+
+
+def write_map_outputs(positions, rates, csv_file=None, map_file=None, thread_map_file=None, source_map=None,
+                      scale=100, chromosome=22):
+    # The Position,Rate CSV, the PLINK map and the map for threads in one call.
+    # The genetic positions come from cumulative_map; the PLINK map holds the
+    # source (positions, gmaps) rows when source_map is given, else the same
+    # rows as the thread map. Returns the genetic positions.
+    gmaps = cumulative_map(positions, rates, scale)
+    # The loops started the running total at the integer 0, printed as "0"
+    gmap_column = [0] + gmaps[1:].tolist()
+    if csv_file is not None:
+        write_rate_table(csv_file, positions, rates)
+    if thread_map_file is not None:
+        write_map_text(thread_map_file, positions, gmap_column, chromosome)
+    if map_file is not None:
+        write_map_text(map_file, *(source_map if source_map is not None else (positions, gmap_column)),
+                       chromosome=chromosome)
+    return gmaps
+
+
+def compute_rates(positions, gmaps, scale=CM_TO_RATE):
+    # Rate of each interval [positions[i], positions[i + 1])
+    return np.diff(gmaps) / np.diff(positions) * scale
+
+
+def rate_map_from_plink(map_file, scale=CM_TO_RATE, start_at_zero=True, cache=True):
+    positions, gmaps = load_map_arrays(map_file, "plink", cache=cache)
+    if start_at_zero:
+        # Anchor the map at (0 bp, 0 cM) as the original scripts did
+        positions = np.insert(positions, 0, 0)
+        gmaps = np.insert(gmaps, 0, 0)
+    rates = compute_rates(positions, gmaps, scale)
+    rate_map = msprime.RateMap(position=positions, rate=rates)
+    return rate_map, positions, rates
+
+
+def rate_map_from_cm(positions, cm):
+    # Same construction as msprime.RateMap.read_hapmap(..., rate_col=None, map_col=3),
+    # so PLINK maps no longer need to be rewritten as HapMap text first
+    positions = np.asarray(positions, dtype=np.int64)
+    genetic_positions = np.asarray(cm, dtype=np.float64) / 100
+    start = positions[0]
+    if genetic_positions[0] > 0 and start == 0:
+        raise ValueError("The map distance at the start of the chromosome must be zero")
+    if start > 0:
+        positions = np.insert(positions, 0, 0)
+        if genetic_positions[0] > 0:
+            # Include the start rate in the mean, as read_hapmap does
+            start = 0
+        genetic_positions = np.insert(genetic_positions, 0, 0)
+    rate = np.diff(genetic_positions) / np.diff(positions)
+    if start != 0:
+        rate[0] = np.nan
+    return msprime.RateMap(position=positions, rate=rate)
+
+
+def rate_map_from_hapmap(map_file, cache=True):
+    positions, cm = load_map_arrays(map_file, "hapmap", cache=cache)
+    return rate_map_from_cm(positions, cm)
+
+
+def rate_map_from_plink_cm(map_file, cache=True):
+    # PLINK map read the way the scripts used to after convert_map_to_hapmap
+    positions, cm = load_map_arrays(map_file, "plink", cache=cache)
+    return rate_map_from_cm(positions, cm)
+
+
+def rate_map_from_csv(csv_file, sequence_length=None, cache=True):
+    # The last row only marks the end of the map unless a sequence length is given
+    positions, rates = load_map_arrays(csv_file, "csv", cache=cache)
+    if sequence_length is not None and sequence_length > positions[-1]:
+        positions = np.append(positions, sequence_length)
+    else:
+        rates = rates[:-1]
+    return msprime.RateMap(position=positions, rate=rates)
+
+
+def load_rate_map(map_file, fmt=None, **kwargs):
+    # Dispatch on file format; guessed from the extension when not given
+    if fmt is None:
+        fmt = guess_format(map_file)
+    if fmt == "plink":
+        return rate_map_from_plink(map_file, **kwargs)[0]
+    if fmt == "hapmap":
+        return rate_map_from_hapmap(map_file, **kwargs)
+    if fmt == "csv":
+        return rate_map_from_csv(map_file, **kwargs)
+    raise ValueError(f"Unknown map format: {fmt}")
+
+
+# argparse types for the comma-separated list options of the scripts
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def float_list(value):
+    return [float(v) for v in value.split(",")]
@@ -0,0 +1,238 @@
+import argparse
+import glob
+import math
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import msprime
+import numpy as np
+import pandas as pd
+
+import export
+import genetic_map
+import replicates
+
+# Whole-genome mode: one PLINK map per chromosome in a directory. Chromosomes
+# are either simulated independently, one process each, or together over a
+# single concatenated RateMap and split afterwards. Every chromosome gets its
+# own output directory, named after the chromosome in its map.
+
+_CHROMOSOME_NAME = re.compile(r"chr([0-9]+|[XYM])(?![0-9A-Za-z])", re.IGNORECASE)
+
+
+def chromosome_name(map_file):
+    # From the file name (plink.chr20.GRCh38.map -> "20"), else the first column
+    match = _CHROMOSOME_NAME.search(os.path.basename(map_file))
+    if match:
+        return match.group(1)
+    with open(map_file) as f:
+        for line in f:
+            if line.strip():
+                return line.split()[0]
+    raise ValueError(f"Empty map file: {map_file}")
+
+
+def _chromosome_order(name):
+    return (0, int(name), "") if name.isdigit() else (1, 0, name)
+
+
+def find_chromosome_maps(map_dir, pattern="*.map"):
+    # [(chromosome, map file)] sorted 1, 2, ..., 22, X, Y
+    maps = {}
+    for map_file in glob.glob(os.path.join(map_dir, pattern)):
+        name = chromosome_name(map_file)
+        if name in maps:
+            raise ValueError(f"Two maps for chromosome {name}: {maps[name]} and {map_file}")
+        maps[name] = map_file
+    if not maps:
+        raise ValueError(f"No maps matching {pattern} in {map_dir}")
+    return sorted(maps.items(), key=lambda item: _chromosome_order(item[0]))
+
+
+def genome_rate_map(rate_maps):
+    # Chromosomes laid end to end, each boundary a 1 bp interval of rate log(2)
+    # so that adjacent chromosomes are unlinked (recombination probability 1/2).
+    # msprime only allows unknown (NaN) rates in the flanks of the genome, so a
+    # chromosome's unmapped start or end between two others gets rate 0.
+    # Returns the map and the start offset of each chromosome.
+    positions = [np.array([0.0])]
+    rates = []
+    offsets = []
+    offset = 0.0
+    for i, rate_map in enumerate(rate_maps):
+        if i > 0:
+            rates.append([math.log(2)])
+            offset += 1
+            positions.append([offset])
+        offsets.append(offset)
+        positions.append(rate_map.position[1:] + offset)
+        rates.append(rate_map.rate)
+        offset += rate_map.sequence_length
+    rate = np.concatenate(rates)
+    known = np.flatnonzero(~np.isnan(rate))
+    interior = rate[known[0]:known[-1] + 1]
+    interior[np.isnan(interior)] = 0
+    return msprime.RateMap(position=np.concatenate(positions), rate=rate), offsets
+
+
+# Columns of the log file, in order
+LOG_COLUMNS = ("chromosome", "name", "sequence_length", "ancestry_seed", "mutation_seed", "num_trees",
+               "num_sites", "seconds") + export.TIMING_COLUMNS
+
+
+def chromosome_prefix(output_dir, output_prefix, chromosome):
+    directory = os.path.join(output_dir, f"chr{chromosome}")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{output_prefix}_chr{chromosome}")
+
+
+def mapped_span(rate_map):
+    # Index range [lo, hi) of the intervals with a known rate, leaving out the
+    # unknown (NaN) flanks before the first and after the last marker
+    known = np.flatnonzero(~np.isnan(rate_map.rate))
+    return known[0], known[-1] + 1
+
+
+def export_chromosome(mts, rate_map, name, chromosome, genotypes=None, argn=False):
+    # Tree sequence, rate CSV and (optionally) genotypes and .argn, plus the
+    # map for threads with this chromosome in its first column. The CSV and the
+    # map cover the mapped span only, so the genetic positions start at 0 there.
+    formats = ["trees", "csv"]
+    if genotypes is not None:
+        formats.append("genotypes")
+    if argn:
+        formats.append("argn")
+    lo, hi = mapped_span(rate_map)
+    timings = export.export_outputs(mts, name, formats, genotypes, positions=rate_map.position[lo:hi + 1],
+                                    rates=rate_map.rate[lo:hi], contig_id=chromosome)
+    genetic_map.write_map_outputs(rate_map.left[lo:hi], rate_map.rate[lo:hi], thread_map_file=name + "_forthread.map",
+                                  chromosome=chromosome)
+    return timings
+
+
+def run_chromosome(task):
+    t0 = time.perf_counter()
+    rate_map = genetic_map.rate_map_from_plink_cm(task["map_file"])
+    ancestry_seed, mutation_seed = replicates.msprime_seeds(task["seed_seq"])
+    mts = replicates.sim_one_const(task["pop_size"], task["sample_size"], rate_map, task["mu_rate"],
+                                   seed=ancestry_seed, mutation_seed=mutation_seed)
+    timings = export_chromosome(mts, rate_map, task["name"], task["chromosome"], task["genotypes"], task["argn"])
+    return {
+        "chromosome": task["chromosome"],
+        "name": task["name"],
+        "sequence_length": rate_map.sequence_length,
+        "ancestry_seed": ancestry_seed,
+        "mutation_seed": mutation_seed,
+        "num_trees": mts.num_trees,
+        "num_sites": mts.num_sites,
+        "seconds": time.perf_counter() - t0,
+        **{f"export_{fmt}_seconds": seconds for fmt, seconds in timings.items()},
+    }
+
+
+def make_chromosome_tasks(maps, sample_size, pop_size, mu_rate, seed, output_dir, output_prefix,
+                          genotypes=None, argn=False):
+    # One independent child seed per chromosome
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(maps))
+    return [{
+        "chromosome": chromosome,
+        "map_file": map_file,
+        "sample_size": sample_size,
+        "pop_size": pop_size,
+        "mu_rate": mu_rate,
+        "seed_seq": seed_seq,
+        "genotypes": genotypes,
+        "argn": argn,
+        "name": chromosome_prefix(output_dir, output_prefix, chromosome),
+    } for (chromosome, map_file), seed_seq in zip(maps, seed_seqs)]
+
+
+def run_genome(tasks, workers=None, log_file=None):
+    # Chromosomes in parallel processes; results in completion order
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_chromosome, task) for task in tasks]
+        for future in as_completed(futures):
+            result = future.result()
+            if log_file is not None:
+                export.append_log_row(log_file, result, LOG_COLUMNS)
+            yield result
+
+
+def split_chromosomes(mts, offsets, lengths, spans=None):
+    # Each chromosome's interval of a joint simulation, shifted back to start at 0.
+    # With spans, only the (start, end) part of each chromosome is kept, as an
+    # independent simulation leaves the unmapped flanks without trees.
+    if spans is None:
+        spans = [(0, length) for length in lengths]
+    for offset, length, (start, end) in zip(offsets, lengths, spans):
+        part = mts.keep_intervals([[offset + start, offset + end]])
+        yield part.shift(-offset, sequence_length=length)
+
+
+def run_joint(maps, sample_size, pop_size, mu_rate, seed, output_dir, output_prefix, genotypes=None, argn=False):
+    # One simulation over the concatenated map, split and exported per chromosome
+    rate_maps = [genetic_map.rate_map_from_plink_cm(map_file) for _, map_file in maps]
+    rate_map, offsets = genome_rate_map(rate_maps)
+    ancestry_seed, mutation_seed = replicates.msprime_seeds(np.random.SeedSequence(seed))
+    mts = replicates.sim_one_const(pop_size, sample_size, rate_map, mu_rate,
+                                   seed=ancestry_seed, mutation_seed=mutation_seed)
+    lengths = [chrom_map.sequence_length for chrom_map in rate_maps]
+    # The unmapped heads were simulated at rate 0; cut them out to match run_chromosome
+    spans = [(chrom_map.left[lo], chrom_map.right[hi - 1])
+             for chrom_map, (lo, hi) in zip(rate_maps, map(mapped_span, rate_maps))]
+    results = []
+    for (chromosome, _), chrom_map, offset, part in zip(maps, rate_maps, offsets,
+                                                        split_chromosomes(mts, offsets, lengths, spans)):
+        t0 = time.perf_counter()
+        name = chromosome_prefix(output_dir, output_prefix, chromosome)
+        timings = export_chromosome(part, chrom_map, name, chromosome, genotypes, argn)
+        results.append({
+            "chromosome": chromosome,
+            "name": name,
+            "offset": offset,
+            "sequence_length": chrom_map.sequence_length,
+            "ancestry_seed": ancestry_seed,
+            "mutation_seed": mutation_seed,
+            "num_trees": part.num_trees,
+            "num_sites": part.num_sites,
+            "seconds": time.perf_counter() - t0,
+            **{f"export_{fmt}_seconds": seconds for fmt, seconds in timings.items()},
+        })
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate every chromosome in a directory of PLINK maps')
+    parser.add_argument("-d", '--map-dir', dest="map_dir", required=True, help="Directory of per-chromosome PLINK maps")
+    parser.add_argument('--pattern', dest="pattern", default="*.map", help="Glob for the map files in the directory")
+    parser.add_argument("-s", '--sample', dest="sample_size", type=int, required=True, help="Diploid sample size")
+    parser.add_argument("-p", '--pop', dest="pop_size", type=int, required=True, help="Effective population size")
+    parser.add_argument("-mu", '--mutation', dest="mu_rate", type=float, default=1e-8, help="Mutation rate")
+    parser.add_argument('--seed', dest="seed", type=int, default=42, help="Root seed for the SeedSequence")
+    parser.add_argument("-j", '--workers', dest="workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("-g", '--genotypes', dest="genotypes", default=None, choices=export.GENOTYPE_FORMATS,
+                        help="Also write genotypes per chromosome as VCF, BGZF VCF or PLINK2 pgen")
+    parser.add_argument('--argn', action="store_true", help="Also write an .argn per chromosome")
+    parser.add_argument('--joint', action="store_true",
+                        help="Simulate all chromosomes together over one concatenated map, then split")
+    parser.add_argument("-o", '--output', dest="output_dir", required=True,
+                        help="Output directory; each chromosome is written to <output>/chr<name>/")
+    parser.add_argument('--prefix', dest="prefix", default="genome", help="File name prefix of the outputs")
+    args = parser.parse_args()
+
+    maps = find_chromosome_maps(args.map_dir, args.pattern)
+    print(f"Found maps for chromosomes {', '.join(name for name, _ in maps)}")
+    os.makedirs(args.output_dir, exist_ok=True)
+    log_file = os.path.join(args.output_dir, f"{args.prefix}_chromosomes.csv")
+    if args.joint:
+        results = run_joint(maps, args.sample_size, args.pop_size, args.mu_rate, args.seed, args.output_dir,
+                            args.prefix, args.genotypes, args.argn)
+        pd.DataFrame(results).to_csv(log_file, index=False)
+    else:
+        tasks = make_chromosome_tasks(maps, args.sample_size, args.pop_size, args.mu_rate, args.seed,
+                                      args.output_dir, args.prefix, args.genotypes, args.argn)
+        for result in run_genome(tasks, args.workers, log_file=log_file):
+            print(f"Completed chromosome {result['chromosome']} in {result['seconds']:.1f}s")
+    print("Done!")
@@ -0,0 +1,100 @@
+import argparse
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import msprime
+import tskit
+
+import export
+import genetic_map
+
+# Mutation overlays: one ancestry simulation, many mutated copies. Mutations
+# are thrown onto the same (mutation-free) tree sequence for every pair of
+# mutation rate and mutation seed, in parallel processes that each load the
+# ancestry once, and every mutated tree sequence is exported under its own name.
+
+# Ancestry tree sequence of this worker process, loaded by _load_ancestry
+_ANCESTRY = None
+
+
+def _load_ancestry(ancestry_file):
+    global _ANCESTRY
+    _ANCESTRY = tskit.load(ancestry_file)
+
+
+def overlay_mutations(ts, mu_rate, seed=None):
+    # Existing mutations are kept as they are; new ones are added on top
+    return msprime.sim_mutations(ts, rate=mu_rate, random_seed=seed)
+
+
+# Columns of the log file, in order
+LOG_COLUMNS = ("name", "mu_rate", "mutation_seed", "num_sites", "num_mutations", "mutate_seconds",
+               "seconds") + export.TIMING_COLUMNS
+
+
+def overlay_name(output_prefix, mu_rate, seed):
+    return f"{output_prefix}_mu{mu_rate:g}_seed{seed}"
+
+
+def run_overlay(task):
+    t0 = time.perf_counter()
+    mts = overlay_mutations(_ANCESTRY, task["mu_rate"], task["seed"])
+    mutate_seconds = time.perf_counter() - t0
+    timings = export.export_outputs(mts, task["name"], task["formats"], task["genotype_format"])
+    return {
+        "name": task["name"],
+        "mu_rate": task["mu_rate"],
+        "mutation_seed": task["seed"],
+        "num_sites": mts.num_sites,
+        "num_mutations": mts.num_mutations,
+        "mutate_seconds": mutate_seconds,
+        "seconds": time.perf_counter() - t0,
+        **{f"export_{fmt}_seconds": seconds for fmt, seconds in timings.items()},
+    }
+
+
+def make_overlay_tasks(mu_rates, seeds, output_prefix, formats=("trees", "genotypes"), genotype_format="vcf"):
+    return [{
+        "mu_rate": mu_rate,
+        "seed": seed,
+        "name": overlay_name(output_prefix, mu_rate, seed),
+        "formats": list(formats),
+        "genotype_format": genotype_format,
+    } for mu_rate, seed in itertools.product(mu_rates, seeds)]
+
+
+def run_overlays(ancestry_file, tasks, workers=None, log_file=None):
+    # Results are yielded (and appended to log_file) in completion order
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load_ancestry, initargs=(ancestry_file,)) as pool:
+        futures = [pool.submit(run_overlay, task) for task in tasks]
+        for future in as_completed(futures):
+            result = future.result()
+            if log_file is not None:
+                export.append_log_row(log_file, result, LOG_COLUMNS)
+            yield result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Overlay mutations at several rates and seeds on one ancestry')
+    parser.add_argument("-t", '--trees', dest="ancestry_file", required=True,
+                        help="Ancestry tree sequence, e.g. from for_ARG/sim_msprime_nomut.py")
+    parser.add_argument("-mu", '--mutation', dest="mu_rates", type=genetic_map.float_list, required=True,
+                        help="Comma-separated mutation rates")
+    parser.add_argument('--seeds', dest="seeds", type=genetic_map.int_list, default=[1],
+                        help="Comma-separated mutation seeds, each used with every rate")
+    parser.add_argument("-j", '--workers', dest="workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("-g", '--genotypes', dest="genotype_format", default="vcf", choices=export.GENOTYPE_FORMATS,
+                        help="Genotype output: plain VCF, BGZF-compressed VCF or PLINK2 pgen/pvar/psam")
+    parser.add_argument("-f", '--formats', dest="formats", default="argn,trees,genotypes",
+                        type=export.formats_type(export.TREE_OUTPUT_FORMATS),
+                        help="Comma-separated outputs to write, from: argn, trees, genotypes")
+    parser.add_argument("-o", '--output', dest="output", required=True,
+                        help="Output prefix; writes <prefix>_mu<rate>_seed<seed>.*")
+    args = parser.parse_args()
+
+    tasks = make_overlay_tasks(args.mu_rates, args.seeds, args.output, args.formats, args.genotype_format)
+    print(f"Overlaying {len(tasks)} mutation sets...")
+    for result in run_overlays(args.ancestry_file, tasks, args.workers, log_file=args.output + "_overlays.csv"):
+        print(f"Completed {result['name']} in {result['seconds']:.1f}s")
+    print("Done!")
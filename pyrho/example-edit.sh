@@ -60,6 +60,11 @@ pyrho make_table -n 200 -N 256 --mu 1e-8 --logfile constant_n250_N256_Ne2000_ldp
     --outfile constant_n200_N256_Ne2000_lookuptable.hdf \
 	--approx --numthreads 8 --popsizes 2000,2000 --epochtimes 0
 
+# The constant-size tables above are listed in table_configs.csv. lookup_tables.py
+# builds only those not in its registry yet, as many at once as fit in the memory
+# budget, and writes the table of every config to lookup_tables.csv:
+python3 lookup_tables.py -c table_configs.csv -m 120 --numthreads 8
+
 
 # This command will output a lot of information while it is computing the lookup table.
 # If you wanted to store that output in a different file, you could set logfile to be
@@ -128,6 +133,13 @@ pyrho hyperparam -n 50 --mu 1e-8 --blockpenalty 15,20,25,30,35,40,45,50 \
 	--popsizes 10000,10000 --epochtimes 0 --outfile constant_n50_N75_Ne10000_hyperparam_results.txt
 # n50_N75_Ne10000: 15, 40
 
+# The same grid by successive halving over all the tables in lookup_tables.csv:
+# one simulation per cell, then 3x the simulations for the best third, and so on.
+# The chosen windowsize and blockpenalty per config go to hyperparameters.csv,
+# which optimize.py reads:
+python3 hyperparam_search.py -c lookup_tables.csv -j 16 -o hyperparameters.csv
+python3 optimize.py -c n50_N75_Ne10000 -v chr22_25_Ne10000.vcf -o constant_n50_N75_Ne10000_map
+
 # This will search over different settings of the hyperparameters (blockpenalty and
 # windowsize).  It will simulate <num_sims> 1Mb chunks and compute some statistics
 # of how well the optimization works on those chunks.
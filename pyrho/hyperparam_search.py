@@ -0,0 +1,167 @@
+import argparse
+import math
+import os
+import re
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import lookup_tables
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import genetic_map
+
+# Successive-halving search over pyrho's windowsize x blockpenalty grid. Every
+# cell is scored with a few simulations first; only the best 1/eta of the cells
+# go on to the next round, with eta times as many simulations, until one cell
+# is left or max_sims is reached. Cells run as separate `pyrho hyperparam`
+# processes over a pool, a cell's score is the simulation-weighted mean over
+# its rounds, and the winner of each configuration is written to a CSV that
+# optimize.py reads.
+
+WINDOW_SIZES = (30, 40, 50, 60, 70, 80, 90)
+BLOCK_PENALTIES = (15, 20, 25, 30, 35, 40, 45, 50)
+
+
+def _normalise(name):
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def higher_is_better(metric):
+    # Correlations are maximised, errors such as L2 and 1-correlations minimised
+    name = _normalise(metric)
+    return ("corr" in name or "pearson" in name or "spearman" in name) and not metric.strip().startswith("1-")
+
+
+def config_name(config):
+    # e.g. n50_N75_Ne10000, as the hand-written notes in example-edit.sh
+    return f"n{config['n']}_N{config['N']}_Ne{config['popsizes'][0]:g}"
+
+
+def hyperparam_command(config, windowsize, blockpenalty, num_sims, outfile, logfile, numthreads=1, ploidy=1):
+    return ["pyrho", "hyperparam", "-n", str(config["n"]), "--mu", f"{config['mu']:g}",
+            "--tablefile", config["table"], "--windowsize", str(windowsize), "--blockpenalty", str(blockpenalty),
+            "--num_sims", str(num_sims), "--ploidy", str(ploidy), "--numthreads", str(numthreads),
+            "--popsizes", lookup_tables.join_values(config["popsizes"]),
+            "--epochtimes", lookup_tables.join_values(config["epochtimes"]),
+            "--logfile", logfile, "--outfile", outfile]
+
+
+def read_score(result_file, metric, windowsize=None, blockpenalty=None):
+    # The metric column of pyrho's results table, for the given cell if the
+    # table holds several
+    df = pd.read_csv(result_file, sep=None, engine="python")
+    columns = {_normalise(c): c for c in df.columns}
+    if _normalise(metric) not in columns:
+        raise ValueError(f"No {metric} column in {result_file} (columns: {', '.join(df.columns)})")
+    window_col = next((c for k, c in columns.items() if "window" in k), None)
+    penalty_col = next((c for k, c in columns.items() if "penalty" in k), None)
+    if windowsize is not None and window_col is not None and penalty_col is not None:
+        df = df[(df[window_col] == windowsize) & (df[penalty_col] == blockpenalty)]
+    return float(df[columns[_normalise(metric)]].iloc[0])
+
+
+def run_cell(task):
+    # One pyrho hyperparam run; kept results are read back instead of rerun
+    if not os.path.exists(task["outfile"]):
+        tmp_file = f"{task['outfile']}.{os.getpid()}.tmp"
+        command = hyperparam_command(task["config"], task["windowsize"], task["blockpenalty"], task["num_sims"],
+                                     tmp_file, task["outfile"][:-len(".txt")] + ".log", task["numthreads"],
+                                     task["ploidy"])
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        os.replace(tmp_file, task["outfile"])
+    return read_score(task["outfile"], task["metric"], task["windowsize"], task["blockpenalty"])
+
+
+def successive_halving(config, pool, work_dir, windowsizes=WINDOW_SIZES, blockpenalties=BLOCK_PENALTIES,
+                       metric="Log_L2", min_sims=1, max_sims=27, eta=3, numthreads=1, ploidy=1):
+    # Returns every scored cell (one row per cell and round) and the best cell
+    maximise = higher_is_better(metric)
+    cells = [(w, b) for w in windowsizes for b in blockpenalties]
+    totals = {cell: [0.0, 0] for cell in cells}
+    rows = []
+    num_sims = min_sims
+    round_number = 0
+    name = config_name(config)
+    prefix = os.path.join(work_dir, f"{name}_{lookup_tables.spec_key(config)}")
+    while True:
+        tasks = [{
+            "config": config,
+            "windowsize": w,
+            "blockpenalty": b,
+            "num_sims": num_sims,
+            "metric": metric,
+            "numthreads": numthreads,
+            "ploidy": ploidy,
+            "outfile": f"{prefix}_w{w}_b{b}_sims{num_sims}_round{round_number}.txt",
+        } for w, b in cells]
+        for (w, b), score in zip(cells, pool.map(run_cell, tasks)):
+            totals[(w, b)][0] += score * num_sims
+            totals[(w, b)][1] += num_sims
+            rows.append({"config": name, "round": round_number, "windowsize": w, "blockpenalty": b,
+                         "num_sims": num_sims, "score": score})
+        ranked = sorted(cells, key=lambda cell: totals[cell][0] / totals[cell][1], reverse=maximise)
+        if len(ranked) == 1 or num_sims * eta > max_sims:
+            break
+        cells = ranked[:math.ceil(len(ranked) / eta)]
+        num_sims *= eta
+        round_number += 1
+    best = ranked[0]
+    return rows, best, totals[best][0] / totals[best][1], totals[best][1]
+
+
+def read_search_configs(config_file):
+    # The table list from lookup_tables.py: configs with a table column
+    df = pd.read_csv(config_file, dtype={"popsizes": str, "epochtimes": str})
+    if "table" not in df:
+        raise ValueError(f"{config_file} has no table column; run lookup_tables.py first")
+    configs = []
+    for row in df.itertuples(index=False):
+        spec = lookup_tables.table_spec(row.n, row.N, row.mu, row.popsizes, row.epochtimes,
+                                        getattr(row, "approx", True))
+        configs.append({**spec, "table": row.table})
+    return configs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Successive-halving pyrho hyperparameter search')
+    parser.add_argument("-c", '--configs', dest="config_file", default="lookup_tables.csv",
+                        help="Configs with their lookup tables, as written by lookup_tables.py")
+    parser.add_argument("-w", '--windowsize', dest="windowsizes", type=genetic_map.int_list,
+                        default=list(WINDOW_SIZES), help="Comma-separated window sizes")
+    parser.add_argument("-b", '--blockpenalty', dest="blockpenalties", type=genetic_map.int_list,
+                        default=list(BLOCK_PENALTIES), help="Comma-separated block penalties")
+    parser.add_argument("-m", '--metric', dest="metric", default="Log_L2",
+                        help="Column of pyrho's results to rank cells by; correlations are maximised, errors minimised")
+    parser.add_argument('--min-sims', dest="min_sims", type=int, default=1, help="Simulations per cell in round one")
+    parser.add_argument('--max-sims', dest="max_sims", type=int, default=27, help="Most simulations per cell in a round")
+    parser.add_argument('--eta', dest="eta", type=int, default=3,
+                        help="Keep the best 1/eta of the cells each round, with eta times the simulations")
+    parser.add_argument('--ploidy', dest="ploidy", type=int, default=1, help="Ploidy passed to pyrho")
+    parser.add_argument('--numthreads', dest="numthreads", type=int, default=1, help="Threads per pyrho run")
+    parser.add_argument("-j", '--jobs', dest="jobs", type=int, default=None, help="pyrho runs at once")
+    parser.add_argument('--work-dir', dest="work_dir", default="hyperparam_runs",
+                        help="Directory of the per-cell results; finished cells are reused on reruns")
+    parser.add_argument("-o", '--output', dest="output", default="hyperparameters.csv",
+                        help="CSV of the chosen windowsize and blockpenalty per config")
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    chosen = []
+    all_rows = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for config in read_search_configs(args.config_file):
+            rows, (windowsize, blockpenalty), score, num_sims = successive_halving(
+                config, pool, args.work_dir, args.windowsizes, args.blockpenalties, args.metric, args.min_sims,
+                args.max_sims, args.eta, args.numthreads, args.ploidy)
+            all_rows += rows
+            chosen.append({"config": config_name(config), "n": config["n"], "N": config["N"], "mu": config["mu"],
+                           "popsizes": lookup_tables.join_values(config["popsizes"]),
+                           "epochtimes": lookup_tables.join_values(config["epochtimes"]), "table": config["table"],
+                           "windowsize": windowsize, "blockpenalty": blockpenalty, "metric": args.metric,
+                           "score": score, "num_sims": num_sims})
+            print(f"{config_name(config)}: windowsize {windowsize}, blockpenalty {blockpenalty}")
+    pd.DataFrame(chosen).to_csv(args.output, index=False)
+    pd.DataFrame(all_rows).to_csv(os.path.join(args.work_dir, "search_rounds.csv"), index=False)
@@ -0,0 +1,181 @@
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import time
+
+import pandas as pd
+
+# Registry of pyrho lookup tables. `pyrho make_table` is the most expensive step
+# of the pyrho comparison (~100 GB of RAM for hundreds of samples), so every
+# table is built once per (n, N, mu, popsizes, epochtimes, approx) and recorded
+# in a JSON registry next to the tables. Runs ask the registry for the tables
+# they need; missing ones are built in parallel within a memory budget.
+
+REGISTRY_FILE = "lookup_tables.json"
+
+# Rough peak memory of make_table in GB per N**3 (Moran population size N,
+# or n without --approx): about 100 GB at N = 256
+MEMORY_SCALE = 6e-6
+
+
+def _float_tuple(value):
+    if isinstance(value, str):
+        value = value.split(",")
+    return tuple(float(v) for v in value)
+
+
+def table_spec(n, N, mu, popsizes, epochtimes, approx=True):
+    # Normalised so that "10000,10000" and (1e4, 1e4) give the same table
+    return {
+        "n": int(n),
+        "N": int(N),
+        "mu": float(mu),
+        "popsizes": _float_tuple(popsizes),
+        "epochtimes": _float_tuple(epochtimes),
+        "approx": bool(approx),
+    }
+
+
+def spec_key(spec):
+    h = hashlib.sha1(repr(tuple(spec[k] for k in ("n", "N", "mu", "popsizes", "epochtimes", "approx"))).encode())
+    return h.hexdigest()[:16]
+
+
+def table_name(spec):
+    return f"n{spec['n']}_N{spec['N']}_mu{spec['mu']:g}_{spec_key(spec)}_lookuptable.hdf"
+
+
+def estimate_memory_gb(spec, scale=MEMORY_SCALE):
+    size = spec["N"] if spec["approx"] else spec["n"]
+    return scale * size ** 3
+
+
+def join_values(values):
+    return ",".join(f"{v:g}" for v in values)
+
+
+def make_table_command(spec, outfile, logfile, numthreads=8):
+    command = ["pyrho", "make_table", "-n", str(spec["n"]), "-N", str(spec["N"]), "--mu", f"{spec['mu']:g}",
+               "--logfile", logfile, "--outfile", outfile, "--numthreads", str(numthreads),
+               "--popsizes", join_values(spec["popsizes"]), "--epochtimes", join_values(spec["epochtimes"])]
+    if spec["approx"]:
+        command.append("--approx")
+    return command
+
+
+class TableRegistry:
+
+    def __init__(self, table_dir="."):
+        self.table_dir = table_dir
+        self.registry_file = os.path.join(table_dir, REGISTRY_FILE)
+        self.entries = {}
+        if os.path.exists(self.registry_file):
+            with open(self.registry_file) as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        os.makedirs(self.table_dir, exist_ok=True)
+        tmp_file = f"{self.registry_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp_file, self.registry_file)
+
+    def lookup(self, spec):
+        # Path of a registered table that still exists, else None
+        entry = self.entries.get(spec_key(spec))
+        if entry is None or not os.path.exists(entry["path"]):
+            return None
+        return entry["path"]
+
+    def register(self, spec, path, seconds=None):
+        self.entries[spec_key(spec)] = {**spec, "path": path, "seconds": seconds,
+                                        "registered": time.strftime("%Y-%m-%d %H:%M:%S")}
+        self.save()
+
+    def build(self, specs, memory_gb, numthreads=8, max_jobs=None, scale=MEMORY_SCALE, poll=5):
+        # Start the largest missing tables first and keep as many running as fit
+        # in memory_gb (a table larger than the budget runs on its own)
+        pending = sorted({spec_key(s): s for s in specs if self.lookup(s) is None}.values(),
+                         key=lambda s: estimate_memory_gb(s, scale), reverse=True)
+        os.makedirs(self.table_dir, exist_ok=True)
+        running = {}
+        failed = []
+        used = 0.0
+        while pending or running:
+            for spec in list(pending):
+                need = min(estimate_memory_gb(spec, scale), memory_gb)
+                if running and (used + need > memory_gb or (max_jobs and len(running) >= max_jobs)):
+                    continue
+                path = os.path.join(self.table_dir, table_name(spec))
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                command = make_table_command(spec, tmp_path, path[:-len(".hdf")] + ".log", numthreads)
+                print(f"Building {path} (~{need:.1f} GB)")
+                running[spec_key(spec)] = (subprocess.Popen(command), spec, path, tmp_path, need, time.time())
+                used += need
+                pending.remove(spec)
+            time.sleep(poll)
+            for key, (process, spec, path, tmp_path, need, t0) in list(running.items()):
+                if process.poll() is None:
+                    continue
+                del running[key]
+                used -= need
+                if process.returncode != 0:
+                    # Let the other runs finish before reporting
+                    failed.append(path)
+                    continue
+                os.replace(tmp_path, path)
+                self.register(spec, path, time.time() - t0)
+                print(f"Built {path} in {time.time() - t0:.0f}s")
+        if failed:
+            raise RuntimeError(f"pyrho make_table failed for {', '.join(failed)}")
+
+    def tables_for(self, specs, memory_gb, **build_kwargs):
+        # Paths for every spec, building the missing ones
+        self.build(specs, memory_gb, **build_kwargs)
+        return [self.lookup(spec) for spec in specs]
+
+
+def read_configs(config_file):
+    # n,N,mu,popsizes,epochtimes[,approx][,table] rows; popsizes and epochtimes
+    # are comma-separated inside quotes. A table column names an existing file
+    # built by hand for that row.
+    df = pd.read_csv(config_file, dtype={"popsizes": str, "epochtimes": str})
+    specs = [table_spec(row.n, row.N, row.mu, row.popsizes, row.epochtimes,
+                        getattr(row, "approx", True)) for row in df.itertuples(index=False)]
+    return df, specs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or reuse pyrho lookup tables from a registry')
+    parser.add_argument("-c", '--configs', dest="config_file", required=True,
+                        help="CSV of n,N,mu,popsizes,epochtimes[,approx][,table] rows")
+    parser.add_argument("-d", '--table-dir', dest="table_dir", default=".", help="Directory of tables and registry")
+    parser.add_argument("-m", '--memory', dest="memory_gb", type=float, required=True,
+                        help="Memory budget in GB for the make_table runs together")
+    parser.add_argument('--mem-scale', dest="mem_scale", type=float, default=MEMORY_SCALE,
+                        help="GB per N**3 used to estimate the memory of one table")
+    parser.add_argument('--numthreads', dest="numthreads", type=int, default=8, help="Threads per make_table run")
+    parser.add_argument("-j", '--jobs', dest="max_jobs", type=int, default=None, help="Most make_table runs at once")
+    parser.add_argument('--dry-run', action="store_true", help="Only list the tables that would be built")
+    parser.add_argument("-o", '--output', dest="output", default="lookup_tables.csv",
+                        help="CSV of the configs with the table path of each")
+    args = parser.parse_args()
+
+    df, specs = read_configs(args.config_file)
+    registry = TableRegistry(args.table_dir)
+    if "table" in df:
+        # Adopt tables already built by hand
+        for spec, table in zip(specs, df["table"]):
+            if isinstance(table, str) and os.path.exists(table) and registry.lookup(spec) is None:
+                registry.register(spec, table)
+    if args.dry_run:
+        for spec in specs:
+            path = registry.lookup(spec)
+            state = f"reuse {path}" if path else f"build (~{estimate_memory_gb(spec, args.mem_scale):.1f} GB)"
+            print(f"n={spec['n']} N={spec['N']} mu={spec['mu']:g} popsizes={join_values(spec['popsizes'])}: {state}")
+    else:
+        df["table"] = registry.tables_for(specs, args.memory_gb, numthreads=args.numthreads,
+                                          max_jobs=args.max_jobs, scale=args.mem_scale)
+        df.to_csv(args.output, index=False)
@@ -0,0 +1,54 @@
+import argparse
+import subprocess
+
+import pandas as pd
+
+# pyrho optimize with the table and hyperparameters chosen for a config by
+# hyperparam_search.py, instead of copying them from notes by hand.
+
+
+def chosen_hyperparameters(hyperparam_file, config):
+    df = pd.read_csv(hyperparam_file)
+    rows = df[df["config"] == config]
+    if rows.empty:
+        raise ValueError(f"No hyperparameters for {config} in {hyperparam_file} "
+                         f"(configs: {', '.join(df['config'])})")
+    return rows.iloc[0]
+
+
+def output_name(prefix, row):
+    # The hyperparameters are part of the name, so runs of one config at other
+    # grid points do not overwrite each other's map and log
+    return f"{prefix}_w{row['windowsize']}_b{row['blockpenalty']}"
+
+
+def optimize_command(row, vcffile, outfile, logfile, ploidy=1):
+    return ["pyrho", "optimize", "--tablefile", row["table"], "--vcffile", vcffile, "--outfile", outfile,
+            "--blockpenalty", str(row["blockpenalty"]), "--windowsize", str(row["windowsize"]),
+            "--ploidy", str(ploidy), "--logfile", logfile]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run pyrho optimize with the searched hyperparameters')
+    parser.add_argument("-c", '--config', dest="config", required=True, help="Config name, e.g. n50_N75_Ne10000")
+    parser.add_argument("-p", '--hyperparameters', dest="hyperparam_file", default="hyperparameters.csv",
+                        help="Output of hyperparam_search.py")
+    parser.add_argument("-v", '--vcffile', dest="vcffile", required=True, help="VCF to infer the map from")
+    parser.add_argument("-w", '--windowsize', dest="windowsize", type=int, default=None,
+                        help="Window size to use instead of the searched one")
+    parser.add_argument("-b", '--blockpenalty', dest="blockpenalty", type=int, default=None,
+                        help="Block penalty to use instead of the searched one")
+    parser.add_argument('--ploidy', dest="ploidy", type=int, default=1, help="Ploidy passed to pyrho")
+    parser.add_argument("-o", '--output', dest="output", required=True,
+                        help="Output prefix; writes <prefix>_w<windowsize>_b<blockpenalty>.rmap and _optimize.log")
+    args = parser.parse_args()
+
+    row = chosen_hyperparameters(args.hyperparam_file, args.config).copy()
+    if args.windowsize is not None:
+        row["windowsize"] = args.windowsize
+    if args.blockpenalty is not None:
+        row["blockpenalty"] = args.blockpenalty
+    name = output_name(args.output, row)
+    print(f"{args.config}: windowsize {row['windowsize']}, blockpenalty {row['blockpenalty']} -> {name}.rmap")
+    subprocess.run(optimize_command(row, args.vcffile, name + ".rmap", name + "_optimize.log", args.ploidy),
+                   check=True)
@@ -0,0 +1,366 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import genetic_map
+
+# Binned recombination-rate estimate from an ARG's recombination nodes, set
+# against the true map averaged over the same bins. This is the table the R
+# scripts built by drawing a ggplot histogram and reading back
+# ggplot_build()$data, computed here directly with NumPy.
+
+
+def read_node_table(node_file, columns=("parent_start", "parent_height")):
+    # Node tables written by get_recombination_nodes.py, as CSV or Parquet
+    if node_file.endswith(".parquet"):
+        df = pd.read_parquet(node_file, columns=list(columns))
+    else:
+        df = pd.read_csv(node_file, usecols=list(columns))
+    return {col: df[col].to_numpy() for col in columns}
+
+
+def recombination_starts(parent_start):
+    # parent_start == 0 marks edges that start at the left end, not a recombination
+    parent_start = np.asarray(parent_start, dtype=np.float64)
+    return parent_start[parent_start != 0]
+
+
+def recombination_events(parent_start, parent_height):
+    # Start and parent height of each recombination, with the same filter
+    parent_start = np.asarray(parent_start, dtype=np.float64)
+    keep = parent_start != 0
+    return parent_start[keep], np.asarray(parent_height, dtype=np.float64)[keep]
+
+
+def bin_edges(x, bins):
+    # Equal-width breaks over the range of x, widened by 0.1% of the range at
+    # both ends as R's cut(x, breaks = bins) does. The R scripts re-parsed these
+    # from the factor labels, which rounds them to three significant digits.
+    lo, hi = float(np.min(x)), float(np.max(x))
+    if lo == hi:
+        lo, hi = lo - abs(lo) / 1000, hi + abs(hi) / 1000
+        return np.linspace(lo, hi, bins + 1)
+    edges = np.linspace(lo, hi, bins + 1)
+    pad = (hi - lo) / 1000
+    edges[0] -= pad
+    edges[-1] += pad
+    return edges
+
+
+def interval_labels(edges):
+    return [f"({a:.6g},{b:.6g}]" for a, b in zip(edges[:-1], edges[1:])]
+
+
+def bin_index(x, edges):
+    # Right-closed bin (a, b] of each x, the same intervals cut() and
+    # geom_histogram(breaks = ...) use; -1 when outside the breaks
+    idx = np.searchsorted(edges, x, side="left") - 1
+    idx[(idx < 0) | (idx >= len(edges) - 1)] = -1
+    return idx
+
+
+def event_counts(x, edges):
+    idx = bin_index(x, edges)
+    return np.bincount(idx[idx >= 0], minlength=len(edges) - 1)
+
+
+def histogram_density(counts, edges, sample_size=1, normalisation=1):
+    # geom_histogram's density (count / (total * width)) along the last axis,
+    # divided by the sample size and any extra normalisation as in the R scripts
+    counts = np.asarray(counts)
+    totals = np.maximum(counts.sum(axis=-1, keepdims=True), 1)
+    return counts / (totals * np.diff(edges)) / sample_size / normalisation
+
+
+def quantile_cutpoints(heights, epochs):
+    # Height cutpoints putting about the same number of events in each epoch,
+    # as quantile(..., probs = seq(0, 1, length.out = epochs + 1)) in R
+    return np.unique(np.quantile(heights, np.linspace(0, 1, epochs + 1)))
+
+
+def epoch_index(heights, cutpoints):
+    # Epoch of each height for cut(..., include.lowest = TRUE): intervals are
+    # (a, b] except the first, which also takes its lower cutpoint
+    cutpoints = np.asarray(cutpoints, dtype=np.float64)
+    idx = np.searchsorted(cutpoints, heights, side="left") - 1
+    idx[heights == cutpoints[0]] = 0
+    idx[(idx < 0) | (idx >= len(cutpoints) - 1)] = -1
+    return idx
+
+
+def epoch_counts(starts, heights, edges, cutpoints):
+    # Events per (epoch, position bin) in one pass over the events
+    num_bins = len(edges) - 1
+    num_epochs = len(cutpoints) - 1
+    bin_idx = bin_index(starts, edges)
+    epoch_idx = epoch_index(heights, cutpoints)
+    keep = (bin_idx >= 0) & (epoch_idx >= 0)
+    flat = epoch_idx[keep] * num_bins + bin_idx[keep]
+    return np.bincount(flat, minlength=num_epochs * num_bins).reshape(num_epochs, num_bins)
+
+
+def _epoch_histogram(parent_start, parent_height, cutpoints, epochs, bins, edges):
+    starts, heights = recombination_events(parent_start, parent_height)
+    if len(starts) == 0:
+        raise ValueError("No recombination events to bin")
+    if cutpoints is None:
+        cutpoints = quantile_cutpoints(heights, epochs)
+    cutpoints = np.asarray(cutpoints, dtype=np.float64)
+    if edges is None:
+        edges = bin_edges(starts, bins)
+    edges = np.asarray(edges, dtype=np.float64)
+    return epoch_counts(starts, heights, edges, cutpoints), edges, cutpoints
+
+
+def epoch_maps(parent_start, parent_height, cutpoints=None, epochs=3, bins=225, edges=None,
+               sample_size=1, normalisation=1):
+    # Per-epoch ARG maps as an (epochs, bins) density array, plus the position
+    # breaks and height cutpoints used. Cutpoints are quantiles of the event
+    # heights when not given. All epochs share the same position breaks.
+    counts, edges, cutpoints = _epoch_histogram(parent_start, parent_height, cutpoints, epochs, bins, edges)
+    return histogram_density(counts, edges, sample_size, normalisation), edges, cutpoints
+
+
+def cumulative_rate(positions, rates):
+    # Integrated rate and covered length at each map position. Rate i applies to
+    # [positions[i], positions[i + 1]) and the last one extends to the right;
+    # missing (NaN) rates count as uncovered.
+    positions = np.asarray(positions, dtype=np.float64)
+    rates = np.asarray(rates, dtype=np.float64)
+    known = ~np.isnan(rates)
+    lengths = np.diff(positions)
+    area = np.concatenate([[0], np.cumsum(np.where(known[:-1], rates[:-1] * lengths, 0))])
+    covered = np.concatenate([[0], np.cumsum(np.where(known[:-1], lengths, 0))])
+    return area, covered, np.where(known, rates, 0), known
+
+
+def integrate_rate(x, positions, area, covered, rates, known):
+    # Integrated rate and covered length from positions[0] up to each x
+    x = np.asarray(x, dtype=np.float64)
+    i = np.searchsorted(positions, x, side="right") - 1
+    inside = i >= 0
+    i = np.clip(i, 0, None)
+    offset = np.where(inside, x - positions[i], 0)
+    return (np.where(inside, area[i] + rates[i] * offset, 0),
+            np.where(inside, covered[i] + known[i] * offset, 0))
+
+
+def interval_mean_rates(positions, rates, edges):
+    # Mean true rate over each bin, weighted by base-pair overlap with the map
+    # intervals. Bins the map does not cover come back as NaN.
+    positions = np.asarray(positions, dtype=np.float64)
+    area, covered, filled, known = cumulative_rate(positions, rates)
+    total, length = integrate_rate(edges, positions, area, covered, filled, known)
+    bin_length = np.diff(length)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(bin_length > 0, np.diff(total) / bin_length, np.nan)
+
+
+def estimate_rates(parent_start, positions, rates, bins=225, edges=None, sample_size=1, normalisation=1):
+    # Merged table with one row per bin: the ARG density (events per bp, divided by
+    # the sample size and any extra normalisation, as in the R scripts) and the
+    # mean true rate. Bins without true rates get the mean over the other bins.
+    starts = recombination_starts(parent_start)
+    if edges is None:
+        if len(starts) == 0:
+            raise ValueError("No recombination events to bin")
+        edges = bin_edges(starts, bins)
+    edges = np.asarray(edges, dtype=np.float64)
+
+    counts = event_counts(starts, edges)
+    density = histogram_density(counts, edges, sample_size, normalisation)
+    return merged_table(edges, counts, density, true_bin_rates(positions, rates, edges))
+
+
+def true_bin_rates(positions, rates, edges):
+    return fill_missing_rates(interval_mean_rates(positions, rates, edges))
+
+
+def fill_missing_rates(true_rate):
+    # Bins without true rates get the mean over the other bins
+    missing = np.isnan(true_rate)
+    if missing.any() and not missing.all():
+        true_rate[missing] = true_rate[~missing].mean()
+    return true_rate
+
+
+def merged_table(edges, counts, density, true_rate):
+    return pd.DataFrame({
+        "Interval": interval_labels(edges),
+        "Start": edges[:-1],
+        "End": edges[1:],
+        "Count": counts,
+        "Density": density,
+        "Rate": true_rate,
+    })
+
+
+def estimate_epoch_rates(parent_start, parent_height, true_maps, cutpoints=None, epochs=3, bins=225,
+                         sample_size=1, normalisation=1):
+    # Merged tables for every epoch stacked in long form. true_maps holds one
+    # (positions, rates) pair shared by all epochs, or one per epoch as in the
+    # staged simulations of simulation_epochs/.
+    counts, edges, cutpoints = _epoch_histogram(parent_start, parent_height, cutpoints, epochs, bins, None)
+    return epoch_table(counts, edges, cutpoints, true_maps, sample_size, normalisation)
+
+
+def epoch_table(counts, edges, cutpoints, true_maps, sample_size=1, normalisation=1):
+    density = histogram_density(counts, edges, sample_size, normalisation)
+    num_epochs = len(cutpoints) - 1
+    if len(true_maps) not in (1, num_epochs):
+        raise ValueError(f"Expected 1 or {num_epochs} true maps, got {len(true_maps)}")
+    true_rates = [true_bin_rates(positions, rates, edges) for positions, rates in true_maps]
+
+    tables = []
+    for e in range(num_epochs):
+        table = merged_table(edges, counts[e], density[e], true_rates[e if len(true_rates) > 1 else 0])
+        table.insert(0, "Epoch", e + 1)
+        table.insert(1, "Height_Lower", cutpoints[e])
+        table.insert(2, "Height_Upper", cutpoints[e + 1])
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+
+def estimate_from_files(node_file, rate_file, bins=225, sample_size=1, normalisation=1):
+    nodes = read_node_table(node_file, columns=("parent_start",))
+    positions, rates = genetic_map.read_rate_csv(rate_file)
+    return estimate_rates(nodes["parent_start"], positions, rates, bins=bins,
+                          sample_size=sample_size, normalisation=normalisation)
+
+
+def iter_node_chunks(node_file, columns=("parent_start", "parent_height"), chunksize=1_000_000):
+    # Stream a node table as dicts of column arrays, chunksize rows at a time
+    if node_file.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(node_file).iter_batches(batch_size=chunksize, columns=list(columns)):
+            yield {col: batch.column(col).to_numpy() for col in columns}
+    else:
+        for df in pd.read_csv(node_file, usecols=list(columns), chunksize=chunksize):
+            yield {col: df[col].to_numpy() for col in columns}
+
+
+def _event_chunks(node_file, with_heights, chunksize):
+    columns = ("parent_start", "parent_height") if with_heights else ("parent_start",)
+    for chunk in iter_node_chunks(node_file, columns, chunksize):
+        if with_heights:
+            yield recombination_events(chunk["parent_start"], chunk["parent_height"])
+        else:
+            yield recombination_starts(chunk["parent_start"]), None
+
+
+def event_ranges(node_file, with_heights=False, chunksize=1_000_000):
+    # Smallest and largest recombination start (and parent height) in one pass
+    lo = hi = hlo = hhi = None
+    for starts, heights in _event_chunks(node_file, with_heights, chunksize):
+        if len(starts) == 0:
+            continue
+        lo = starts.min() if lo is None else min(lo, starts.min())
+        hi = starts.max() if hi is None else max(hi, starts.max())
+        if with_heights:
+            hlo = heights.min() if hlo is None else min(hlo, heights.min())
+            hhi = heights.max() if hhi is None else max(hhi, heights.max())
+    if lo is None:
+        raise ValueError("No recombination events to bin")
+    return (lo, hi, hlo, hhi) if with_heights else (lo, hi)
+
+
+def streamed_quantile_cutpoints(node_file, epochs, height_range, resolution=1 << 16, chunksize=1_000_000):
+    # quantile_cutpoints without holding every height: heights are counted into
+    # `resolution` bins equally spaced on a log1p scale (node heights are
+    # roughly exponential) and the quantiles are interpolated within a bin
+    hlo, hhi = height_range
+    fine_edges = np.expm1(np.linspace(np.log1p(hlo), np.log1p(hhi), resolution + 1))
+    fine_edges[0], fine_edges[-1] = hlo, hhi
+    fine_counts = np.zeros(resolution, dtype=np.int64)
+    for _, heights in _event_chunks(node_file, True, chunksize):
+        fine_counts += np.histogram(heights, bins=fine_edges)[0]
+    cumulative = np.concatenate([[0], np.cumsum(fine_counts)]) / fine_counts.sum()
+    cutpoints = np.interp(np.linspace(0, 1, epochs + 1), cumulative, fine_edges)
+    cutpoints[0], cutpoints[-1] = hlo, hhi
+    return np.unique(cutpoints)
+
+
+def accumulate_counts(node_file, edges, cutpoints=None, chunksize=1_000_000):
+    # Per-bin event counts, or (epochs, bins) counts when cutpoints are given,
+    # added up chunk by chunk so memory depends on the bins, not the events
+    edges = np.asarray(edges, dtype=np.float64)
+    with_heights = cutpoints is not None
+    if with_heights:
+        cutpoints = np.asarray(cutpoints, dtype=np.float64)
+        counts = np.zeros((len(cutpoints) - 1, len(edges) - 1), dtype=np.int64)
+    else:
+        counts = np.zeros(len(edges) - 1, dtype=np.int64)
+    for starts, heights in _event_chunks(node_file, with_heights, chunksize):
+        if with_heights:
+            counts += epoch_counts(starts, heights, edges, cutpoints)
+        else:
+            counts += event_counts(starts, edges)
+    return counts
+
+
+def estimate_rates_chunked(node_file, rate_file, bins=225, sample_size=1, normalisation=1, chunksize=1_000_000):
+    # estimate_from_files for node tables too large to load: one pass for the
+    # range of the breaks, one for the counts
+    lo, hi = event_ranges(node_file, chunksize=chunksize)
+    edges = bin_edges(np.array([lo, hi]), bins)
+    counts = accumulate_counts(node_file, edges, chunksize=chunksize)
+    positions, rates = genetic_map.read_rate_csv(rate_file)
+    density = histogram_density(counts, edges, sample_size, normalisation)
+    return merged_table(edges, counts, density, true_bin_rates(positions, rates, edges))
+
+
+def estimate_epoch_rates_chunked(node_file, true_maps, cutpoints=None, epochs=3, bins=225, sample_size=1,
+                                 normalisation=1, chunksize=1_000_000):
+    # estimate_epoch_rates over a streamed node table. Quantile cutpoints take an
+    # extra pass and are approximate (see streamed_quantile_cutpoints).
+    lo, hi, hlo, hhi = event_ranges(node_file, with_heights=True, chunksize=chunksize)
+    edges = bin_edges(np.array([lo, hi]), bins)
+    if cutpoints is None:
+        cutpoints = streamed_quantile_cutpoints(node_file, epochs, (hlo, hhi), chunksize=chunksize)
+    counts = accumulate_counts(node_file, edges, cutpoints, chunksize)
+    return epoch_table(counts, edges, cutpoints, true_maps, sample_size, normalisation)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Binned recombination rate from ARG nodes against the true map')
+    parser.add_argument("-a", '--arg', dest="node_file", required=True,
+                        help="Recombination node table from get_recombination_nodes.py (.csv or .parquet)")
+    parser.add_argument("-r", '--rates', dest="rate_files", nargs="+", required=True,
+                        help="True Position,Rate CSV; with epochs, one shared file or one per epoch")
+    parser.add_argument("-b", '--bins', dest="bins", type=int, default=225, help="Number of bins")
+    parser.add_argument("-s", '--sample', dest="sample_size", type=float, default=1,
+                        help="Sample size the histogram density is divided by")
+    parser.add_argument("-n", '--normalisation', dest="normalisation", type=float, default=1,
+                        help="Extra factor the density is divided by")
+    parser.add_argument("-e", '--epochs', dest="epochs", type=int, default=None,
+                        help="Split events into this many parent-height quantile epochs")
+    parser.add_argument("-c", '--cutpoints', dest="cutpoints", type=genetic_map.float_list, default=None,
+                        help="Comma-separated parent-height cutpoints for the epochs, e.g. 0,5000,10000,inf")
+    parser.add_argument('--chunksize', dest="chunksize", type=int, default=None,
+                        help="Stream the node table this many rows at a time instead of loading it")
+    parser.add_argument("-o", '--output', dest="output", required=True, help="Output CSV of the merged table")
+    args = parser.parse_args()
+
+    if args.epochs is None and args.cutpoints is None:
+        if len(args.rate_files) != 1:
+            parser.error("Give one true rate file unless splitting into epochs")
+        if args.chunksize:
+            merged = estimate_rates_chunked(args.node_file, args.rate_files[0], args.bins, args.sample_size,
+                                            args.normalisation, args.chunksize)
+        else:
+            merged = estimate_from_files(args.node_file, args.rate_files[0], args.bins, args.sample_size,
+                                         args.normalisation)
+    elif args.chunksize:
+        true_maps = [genetic_map.read_rate_csv(rate_file) for rate_file in args.rate_files]
+        merged = estimate_epoch_rates_chunked(args.node_file, true_maps, cutpoints=args.cutpoints,
+                                              epochs=args.epochs or 3, bins=args.bins,
+                                              sample_size=args.sample_size, normalisation=args.normalisation,
+                                              chunksize=args.chunksize)
+    else:
+        nodes = read_node_table(args.node_file)
+        true_maps = [genetic_map.read_rate_csv(rate_file) for rate_file in args.rate_files]
+        merged = estimate_epoch_rates(nodes["parent_start"], nodes["parent_height"], true_maps,
+                                      cutpoints=args.cutpoints, epochs=args.epochs or 3, bins=args.bins,
+                                      sample_size=args.sample_size, normalisation=args.normalisation)
+    merged.to_csv(args.output, index=False)
@@ -0,0 +1,114 @@
+import argparse
+
+import numpy as np
+
+import genetic_map
+import rate_estimate
+
+# Prefix-sum index over the recombination events of an ARG and the true rate
+# map. Built once per run, it answers "how many events / what mean true rate
+# over (a, b]" for any interval without rebinning: exactly by binary search,
+# or in O(1) when both ends fall on the grid of one of the precomputed levels.
+
+DEFAULT_LEVELS = (1_000, 10_000, 100_000, 1_000_000)
+
+
+class RateIndex:
+
+    def __init__(self, starts, positions, rates, levels=DEFAULT_LEVELS):
+        self.starts = np.sort(rate_estimate.recombination_starts(starts))
+        self.positions = np.asarray(positions, dtype=np.float64)
+        self.area, self.covered, self._rates, self._known = rate_estimate.cumulative_rate(self.positions, rates)
+        self.end = max(self.starts[-1] if len(self.starts) else 0, self.positions[-1])
+        # Cumulative events, integrated rate and covered length on each level's
+        # grid 0, w, 2w, ... past the last event or map position
+        self.levels = {}
+        for width in levels:
+            grid = np.arange(0, self.end + width, width, dtype=np.float64)
+            self.levels[width] = (self._event_cumsum(grid),) + self._map_cumsum(grid)
+
+    @classmethod
+    def from_files(cls, node_file, rate_file, levels=DEFAULT_LEVELS):
+        nodes = rate_estimate.read_node_table(node_file, columns=("parent_start",))
+        positions, rates = genetic_map.read_rate_csv(rate_file)
+        return cls(nodes["parent_start"], positions, rates, levels)
+
+    def _event_cumsum(self, x):
+        # Events at or before x, so differences count (a, b] like the binned tables
+        return np.searchsorted(self.starts, x, side="right")
+
+    def _map_cumsum(self, x):
+        return rate_estimate.integrate_rate(x, self.positions, self.area, self.covered, self._rates, self._known)
+
+    def _level_for(self, a, b):
+        # Coarsest level whose grid holds every end point, if any
+        lo, hi = min(np.min(a), np.min(b)), max(np.max(a), np.max(b))
+        for width in sorted(self.levels, reverse=True):
+            on_grid = np.all(a % width == 0) and np.all(b % width == 0)
+            if on_grid and lo >= 0 and hi // width < len(self.levels[width][0]):
+                return width
+        return None
+
+    def _cumulative(self, x, width):
+        if width is None:
+            return (self._event_cumsum(x),) + self._map_cumsum(x)
+        k = (x // width).astype(np.int64)
+        return tuple(level[k] for level in self.levels[width])
+
+    def query(self, a, b):
+        # Event count, integrated true rate and covered length over (a, b];
+        # a and b may be scalars or arrays of interval ends
+        a = np.asarray(a, dtype=np.float64)
+        b = np.asarray(b, dtype=np.float64)
+        width = self._level_for(a, b)
+        events_a, area_a, covered_a = self._cumulative(a, width)
+        events_b, area_b, covered_b = self._cumulative(b, width)
+        return events_b - events_a, area_b - area_a, covered_b - covered_a
+
+    def event_count(self, a, b):
+        return self.query(a, b)[0]
+
+    def mean_rate(self, a, b):
+        _, area, covered = self.query(a, b)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(covered > 0, area / covered, np.nan)
+
+    def merged_table(self, width, start=0, end=None, sample_size=1, normalisation=1):
+        # rate_estimate's merged table for bins of `width` bp from start to end,
+        # read straight off the index
+        end = self.end if end is None else end
+        edges = np.arange(start, end + width, width, dtype=np.float64)
+        counts, area, covered = self.query(edges[:-1], edges[1:])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            true_rate = rate_estimate.fill_missing_rates(np.where(covered > 0, area / covered, np.nan))
+        density = rate_estimate.histogram_density(counts, edges, sample_size, normalisation)
+        return rate_estimate.merged_table(edges, counts, density, true_rate)
+
+    def save(self, index_file):
+        arrays = {"starts": self.starts, "positions": self.positions,
+                  "rates": np.where(self._known, self._rates, np.nan),
+                  "levels": np.array(sorted(self.levels), dtype=np.float64)}
+        np.savez(index_file, **arrays)
+
+    @classmethod
+    def load(cls, index_file):
+        with np.load(index_file) as data:
+            return cls(data["starts"], data["positions"], data["rates"], tuple(data["levels"]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merged ARG/true rate tables at several bin widths from one index')
+    parser.add_argument("-a", '--arg', dest="node_file", required=True,
+                        help="Recombination node table from get_recombination_nodes.py (.csv or .parquet)")
+    parser.add_argument("-r", '--rates', dest="rate_file", required=True, help="True Position,Rate CSV")
+    parser.add_argument("-w", '--widths', dest="widths", type=genetic_map.float_list, default=list(DEFAULT_LEVELS),
+                        help="Comma-separated bin widths in bp")
+    parser.add_argument("-s", '--sample', dest="sample_size", type=float, default=1,
+                        help="Sample size the histogram density is divided by")
+    parser.add_argument("-o", '--output', dest="output", required=True,
+                        help="Output prefix; writes <prefix>_<width>bp.csv per width")
+    args = parser.parse_args()
+
+    index = RateIndex.from_files(args.node_file, args.rate_file, levels=args.widths)
+    for width in args.widths:
+        index.merged_table(width, sample_size=args.sample_size).to_csv(f"{args.output}_{width:g}bp.csv", index=False)
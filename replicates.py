@@ -0,0 +1,192 @@
+import argparse
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import msprime
+import numpy as np
+
+import export
+import genetic_map
+import sim_cache
+
+# Replicate driver: fans a grid of (sample size, Ne, mu, map window, seed) out
+# over a process pool. Each worker loads the rate map once and writes its own
+# outputs as soon as its replicate finishes.
+
+# Rate maps already loaded by this worker process, keyed by map file
+_RATE_MAPS = {}
+
+
+def worker_rate_map(map_file):
+    if map_file not in _RATE_MAPS:
+        _RATE_MAPS[map_file] = genetic_map.load_rate_map(map_file)
+    return _RATE_MAPS[map_file]
+
+
+def msprime_seeds(seed_seq, n=2):
+    # msprime wants seeds in [1, 2**32 - 1]
+    return [int(s) % (2**32 - 1) + 1 for s in seed_seq.generate_state(n)]
+
+
+def sim_one_const(pop_size, sample_size, rate_map, mu_rate, seed=None, mutation_seed=None):
+    # Create a demographic model for a constant-size population
+    demographic_model = msprime.Demography()
+    demographic_model.add_population(initial_size=pop_size)
+
+    # Simulate the tree sequence
+    ts = msprime.sim_ancestry(
+        samples=sample_size,
+        demography=demographic_model,
+        recombination_rate=rate_map,
+        ploidy=2,
+        random_seed=seed
+    )
+
+    # Simulate mutations
+    mts = msprime.sim_mutations(ts, rate=mu_rate, random_seed=mutation_seed if mutation_seed is not None else seed)
+
+    return mts
+
+
+def random_window(rate_map, length, rng):
+    # Uniform window start over the mapped part of the sequence
+    first = rate_map.right[0]
+    last = rate_map.sequence_length - length
+    if last < first:
+        raise ValueError(f"Not enough data for a {length} bp segment.")
+    start = np.floor(rng.uniform(first, last))
+    return rate_map.slice(start, start + length, trim=True), start
+
+
+# Columns of the log file, in order
+LOG_COLUMNS = ("name", "sample_size", "pop_size", "mu_rate", "window", "window_start", "replicate",
+               "ancestry_seed", "mutation_seed", "num_trees", "num_sites", "seconds") + export.TIMING_COLUMNS
+
+
+def replicate_name(output_prefix, task):
+    name = f"{output_prefix}_{task['sample_size']}_Ne{task['pop_size']}_mu{task['mu_rate']:g}"
+    if task["window"] is not None:
+        name += f"_win{task['window']}"
+    return f"{name}_rep{task['replicate']}"
+
+
+def run_replicate(task):
+    t0 = time.perf_counter()
+    rate_map = worker_rate_map(task["map_file"])
+    # Independent streams for the window draw and for the msprime seeds
+    window_seed_seq, sim_seed_seq = task["seed_seq"].spawn(2)
+    rng = np.random.default_rng(window_seed_seq)
+    start = 0
+    if task["window"] is not None:
+        rate_map, start = random_window(rate_map, task["window"], rng)
+    ancestry_seed, mutation_seed = msprime_seeds(sim_seed_seq)
+
+    cache = None
+    if task.get("cache_dir") is not None:
+        cache = sim_cache.SimulationCache(task["cache_dir"], task["cache_bytes"])
+        mts, key = cache.call(sim_one_const, task["pop_size"], task["sample_size"], rate_map, task["mu_rate"],
+                              seed=ancestry_seed, mutation_seed=mutation_seed)
+    else:
+        mts = sim_one_const(task["pop_size"], task["sample_size"], rate_map, task["mu_rate"],
+                            seed=ancestry_seed, mutation_seed=mutation_seed)
+
+    name = task["name"]
+    formats = ["trees", "csv"]
+    if task["genotypes"] is not None:
+        formats.append("genotypes")
+    if task["argn"]:
+        formats.append("argn")
+    if cache is not None:
+        timings = sim_cache.export_cached(cache, key, mts, name, formats, task["genotypes"],
+                                          positions=rate_map.position, rates=rate_map.rate)
+    else:
+        timings = export.export_outputs(mts, name, formats, task["genotypes"],
+                                        positions=rate_map.position, rates=rate_map.rate)
+
+    return {
+        "name": name,
+        "sample_size": task["sample_size"],
+        "pop_size": task["pop_size"],
+        "mu_rate": task["mu_rate"],
+        "window": task["window"],
+        "window_start": start,
+        "replicate": task["replicate"],
+        "ancestry_seed": ancestry_seed,
+        "mutation_seed": mutation_seed,
+        "num_trees": mts.num_trees,
+        "num_sites": mts.num_sites,
+        "seconds": time.perf_counter() - t0,
+        **{f"export_{fmt}_seconds": seconds for fmt, seconds in timings.items()},
+    }
+
+
+def make_tasks(map_file, sample_sizes, pop_sizes, mu_rates, windows, replicates, seed, output_prefix,
+               genotypes=None, argn=False, cache_dir=None, cache_bytes=sim_cache.DEFAULT_MAX_BYTES):
+    grid = list(itertools.product(sample_sizes, pop_sizes, mu_rates, windows, range(replicates)))
+    # One independent child seed sequence per grid cell
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(grid))
+    tasks = []
+    for (sample_size, pop_size, mu_rate, window, rep), seed_seq in zip(grid, seed_seqs):
+        task = {
+            "map_file": map_file,
+            "sample_size": sample_size,
+            "pop_size": pop_size,
+            "mu_rate": mu_rate,
+            "window": window,
+            "replicate": rep,
+            "seed_seq": seed_seq,
+            "genotypes": genotypes,
+            "argn": argn,
+            "cache_dir": cache_dir,
+            "cache_bytes": cache_bytes,
+        }
+        task["name"] = replicate_name(output_prefix, task)
+        tasks.append(task)
+    return tasks
+
+
+def run_replicates(tasks, workers=None, log_file=None):
+    # Results are yielded (and appended to log_file) in completion order
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_replicate, task) for task in tasks]
+        for future in as_completed(futures):
+            result = future.result()
+            if log_file is not None:
+                export.append_log_row(log_file, result, LOG_COLUMNS)
+            yield result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a grid of msprime replicates in parallel')
+    parser.add_argument("-m", '--map', dest="map_file", required=True, help="Path to the genetic map file")
+    parser.add_argument("-s", '--samples', dest="sample_sizes", type=genetic_map.int_list, required=True,
+                        help="Comma-separated diploid sample sizes, e.g. 25,50,75")
+    parser.add_argument("-p", '--pop', dest="pop_sizes", type=genetic_map.int_list, required=True,
+                        help="Comma-separated effective population sizes")
+    parser.add_argument("-mu", '--mutation', dest="mu_rates", type=genetic_map.float_list, default=[1e-8],
+                        help="Comma-separated mutation rates")
+    parser.add_argument("-w", '--window', dest="windows", type=genetic_map.int_list, default=None,
+                        help="Comma-separated window lengths in bp; the whole map is used if omitted")
+    parser.add_argument("-r", '--replicates', dest="replicates", type=int, default=1, help="Replicates per grid cell")
+    parser.add_argument('--seed', dest="seed", type=int, default=42, help="Root seed for the SeedSequence")
+    parser.add_argument("-j", '--workers', dest="workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("-g", '--genotypes', dest="genotypes", default=None, choices=export.GENOTYPE_FORMATS,
+                        help="Also write genotypes per replicate as VCF, BGZF VCF or PLINK2 pgen")
+    parser.add_argument('--argn', action="store_true", help="Also write an .argn per replicate")
+    parser.add_argument('--cache-dir', dest="cache_dir", default=None,
+                        help="Reuse simulations and exports from this result cache")
+    parser.add_argument('--cache-size', dest="cache_size", type=sim_cache.parse_size,
+                        default=sim_cache.DEFAULT_MAX_BYTES, help="Size cap of the result cache, e.g. 20G")
+    parser.add_argument("-o", '--output', dest="output", required=True, help="Output file prefix")
+
+    args = parser.parse_args()
+
+    tasks = make_tasks(args.map_file, args.sample_sizes, args.pop_sizes, args.mu_rates,
+                       args.windows or [None], args.replicates, args.seed, args.output,
+                       genotypes=args.genotypes, argn=args.argn, cache_dir=args.cache_dir,
+                       cache_bytes=args.cache_size)
+    print(f"Running {len(tasks)} replicates...")
+    for result in run_replicates(tasks, args.workers, log_file=args.output + "_replicates.csv"):
+        print(f"Completed {result['name']} in {result['seconds']:.1f}s")
+    print("Done!")
@@ -0,0 +1,155 @@
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import tskit
+
+import export
+import genetic_map
+import replicates
+
+# Nested sample-size series from one simulation: the largest sample is
+# simulated once and every smaller sample is the first n individuals of one
+# random order of it, cut out with ts.simplify. Curves over sample size then
+# differ only by the samples added, not by independent simulation noise.
+
+# Full tree sequence of this worker process, loaded by _load_series
+_SERIES = None
+
+
+def _load_series(trees_file):
+    global _SERIES
+    _SERIES = tskit.load(trees_file)
+
+
+def nested_individuals(ts, sample_sizes, rng=None):
+    # {n: individual ids} with each smaller set contained in every larger one
+    order = np.random.default_rng(rng).permutation(ts.num_individuals)
+    if max(sample_sizes) > len(order):
+        raise ValueError(f"Only {len(order)} individuals to draw {max(sample_sizes)} from")
+    return {n: np.sort(order[:n]) for n in sample_sizes}
+
+
+def subset(ts, individuals):
+    # Both genomes of each individual; the individuals table is renumbered to match.
+    # simplify keeps sites whose mutations all samples now carry, so the sites
+    # that no longer vary in the subset are dropped as well.
+    nodes = ts.individuals_nodes[individuals].ravel()
+    ts = ts.simplify(samples=nodes)
+    if ts.num_sites == 0:
+        return ts
+    # One window per site, so a zero count marks a site that does not segregate
+    segregating = ts.segregating_sites(windows="sites", mode="site", span_normalise=False)
+    return ts.delete_sites(np.flatnonzero(segregating == 0))
+
+
+# Columns of the log file, in order
+LOG_COLUMNS = ("name", "sample_size", "num_trees", "num_sites", "simplify_seconds",
+               "seconds") + export.TIMING_COLUMNS
+
+
+def series_name(name_template, sample_size):
+    # Templates such as "chr22_{n}_Ne10000", which the run_*.sh loops expect
+    return name_template.format(n=sample_size)
+
+
+def run_subset(task):
+    t0 = time.perf_counter()
+    ts = subset(_SERIES, task["individuals"])
+    simplify_seconds = time.perf_counter() - t0
+    timings = export.export_outputs(ts, task["name"], task["formats"], task["genotype_format"],
+                                    positions=task["positions"], rates=task["rates"])
+    return {
+        "name": task["name"],
+        "sample_size": task["sample_size"],
+        "num_trees": ts.num_trees,
+        "num_sites": ts.num_sites,
+        "simplify_seconds": simplify_seconds,
+        "seconds": time.perf_counter() - t0,
+        **{f"export_{fmt}_seconds": seconds for fmt, seconds in timings.items()},
+    }
+
+
+def make_series_tasks(ts, sample_sizes, name_template, formats=("argn", "trees", "genotypes"),
+                      genotype_format="vcf", positions=None, rates=None, rng=None):
+    individuals = nested_individuals(ts, sample_sizes, rng)
+    return [{
+        "sample_size": n,
+        "individuals": individuals[n],
+        "name": series_name(name_template, n),
+        "formats": list(formats),
+        "genotype_format": genotype_format,
+        "positions": positions,
+        "rates": rates,
+    } for n in sorted(sample_sizes, reverse=True)]
+
+
+def run_series(trees_file, tasks, workers=None, log_file=None):
+    # Subsets are simplified and exported in parallel; results in completion order
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load_series, initargs=(trees_file,)) as pool:
+        futures = [pool.submit(run_subset, task) for task in tasks]
+        for future in as_completed(futures):
+            result = future.result()
+            if log_file is not None:
+                export.append_log_row(log_file, result, LOG_COLUMNS)
+            yield result
+
+
+def size_list(value):
+    # "25,50,100" or an inclusive range "25:500:25"
+    if ":" in value:
+        start, stop, step = (int(v) for v in value.split(":"))
+        return list(range(start, stop + 1, step))
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Nested sample-size series from one msprime simulation')
+    parser.add_argument("-m", '--map', dest="map_file", default=None,
+                        help="Genetic map to simulate over (not needed with --trees)")
+    parser.add_argument("-t", '--trees', dest="trees_file", default=None,
+                        help="Existing simulation to subsample instead of running a new one")
+    parser.add_argument("-s", '--samples', dest="sample_sizes", type=size_list, required=True,
+                        help="Diploid sample sizes, comma-separated or as start:stop:step, e.g. 25:500:25")
+    parser.add_argument("-p", '--pop', dest="pop_size", type=int, default=10000, help="Effective population size")
+    parser.add_argument("-mu", '--mutation', dest="mu_rate", type=float, default=1e-8, help="Mutation rate")
+    parser.add_argument('--seed', dest="seed", type=int, default=42, help="Root seed for the SeedSequence")
+    parser.add_argument("-j", '--workers', dest="workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("-g", '--genotypes', dest="genotype_format", default="vcf", choices=export.GENOTYPE_FORMATS,
+                        help="Genotype output: plain VCF, BGZF-compressed VCF or PLINK2 pgen/pvar/psam")
+    parser.add_argument("-f", '--formats', dest="formats", default="argn,trees,genotypes",
+                        type=export.formats_type(export.OUTPUT_FORMATS),
+                        help="Comma-separated outputs per sample size, from: argn, trees, genotypes, csv")
+    parser.add_argument("-o", '--output', dest="output", default="chr22_{n}_Ne10000",
+                        help="Output name template; {n} is replaced by the sample size")
+    args = parser.parse_args()
+
+    if "{n}" not in args.output:
+        parser.error("The output template needs an {n} for the sample size")
+    if (args.map_file is None) == (args.trees_file is None):
+        parser.error("Give either a map to simulate over or an existing --trees file")
+
+    ancestry_seed_seq, subset_seed_seq = np.random.SeedSequence(args.seed).spawn(2)
+    positions = rates = None
+    trees_file = args.trees_file
+    if trees_file is None:
+        rate_map = genetic_map.load_rate_map(args.map_file)
+        positions, rates = rate_map.position, rate_map.rate
+        ancestry_seed, mutation_seed = replicates.msprime_seeds(ancestry_seed_seq)
+        print(f"Simulating {max(args.sample_sizes)} diploids...")
+        mts = replicates.sim_one_const(args.pop_size, max(args.sample_sizes), rate_map, args.mu_rate,
+                                       seed=ancestry_seed, mutation_seed=mutation_seed)
+        trees_file = series_name(args.output, "full") + ".trees"
+        mts.dump(trees_file)
+    else:
+        mts = tskit.load(trees_file)
+        if "csv" in args.formats:
+            parser.error("csv output needs the map; use --map")
+
+    tasks = make_series_tasks(mts, args.sample_sizes, args.output, args.formats, args.genotype_format,
+                              positions, rates, rng=subset_seed_seq)
+    log_file = series_name(args.output, "series") + ".csv"
+    for result in run_series(trees_file, tasks, args.workers, log_file=log_file):
+        print(f"Completed {result['name']} in {result['seconds']:.1f}s")
+    print("Done!")
@@ -0,0 +1,243 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import shutil
+
+import msprime
+import numpy as np
+import tskit
+
+import export
+
+# Content-addressed cache of simulation results. A call is keyed by the SHA-1
+# of the function's module and name and its full argument set, with rate maps
+# hashed by their positions and rates and initial tree sequences by their
+# tables; calls with seed=None are refused. Each entry is a directory holding
+# the resulting .trees and any exports derived from it (.argn, VCF, pgen),
+# which are copied into place on later runs. The cache is kept under a size
+# cap by evicting the least recently used entries.
+
+DEFAULT_CACHE_DIR = ".sim_cache"
+DEFAULT_MAX_BYTES = 50 << 30
+TREES_FILE = "result.trees"
+PARAMS_FILE = "params.json"
+
+
+def _hash_value(h, value):
+    # Arrays by dtype, shape and bytes; containers element by element
+    if isinstance(value, msprime.RateMap):
+        h.update(b"RateMap")
+        _hash_value(h, np.asarray(value.position, dtype=np.float64))
+        _hash_value(h, np.asarray(value.rate, dtype=np.float64))
+    elif isinstance(value, tskit.TreeSequence):
+        h.update(b"TreeSequence")
+        _hash_value(h, value.tables.asdict())
+    elif isinstance(value, np.ndarray):
+        h.update(f"{value.dtype.str}{value.shape}".encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        h.update(b"{")
+        for k in sorted(value, key=str):
+            h.update(repr(k).encode())
+            _hash_value(h, value[k])
+        h.update(b"}")
+    elif isinstance(value, (list, tuple)):
+        h.update(b"[")
+        for v in value:
+            _hash_value(h, v)
+        h.update(b"]")
+    else:
+        h.update(repr(value).encode())
+
+
+def _function_name(func):
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+def call_key(func, *args, **kwargs):
+    # Defaults are filled in, so positional and keyword calls share a key. An
+    # unseeded call gives a different result every time, so it has no key.
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    if "seed" in bound.arguments and bound.arguments["seed"] is None:
+        raise ValueError(f"Cannot cache {_function_name(func)} without a seed")
+    h = hashlib.sha1(_function_name(func).encode())
+    _hash_value(h, dict(bound.arguments))
+    return h.hexdigest()
+
+
+def _describe(value):
+    # Readable stand-in for params.json
+    if isinstance(value, msprime.RateMap):
+        return f"RateMap({value.num_intervals} intervals, {value.sequence_length:g} bp)"
+    if isinstance(value, tskit.TreeSequence):
+        return f"TreeSequence({value.num_trees} trees, {value.num_nodes} nodes)"
+    if isinstance(value, (int, float, str, bool)) or value is None:
+        return value
+    return repr(value)
+
+
+def _entry_size(entry):
+    return sum(f.stat().st_size for f in os.scandir(entry) if f.is_file())
+
+
+def parse_size(value):
+    # "500M", "20G", or a plain number of bytes
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+class SimulationCache:
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _touch(self, key):
+        # Recency for eviction is the entry directory's modification time
+        try:
+            os.utime(self.entry_dir(key))
+        except FileNotFoundError:
+            pass
+
+    def lookup(self, key):
+        trees_file = os.path.join(self.entry_dir(key), TREES_FILE)
+        if not os.path.exists(trees_file):
+            return None
+        self._touch(key)
+        return tskit.load(trees_file)
+
+    def store(self, key, mts, params=None):
+        # Written to a scratch directory and renamed into place; when another
+        # process stored the same key first, its entry is kept
+        entry = self.entry_dir(key)
+        tmp_entry = f"{entry}.{os.getpid()}.tmp"
+        os.makedirs(tmp_entry, exist_ok=True)
+        mts.dump(os.path.join(tmp_entry, TREES_FILE))
+        if params is not None:
+            with open(os.path.join(tmp_entry, PARAMS_FILE), "w") as f:
+                json.dump({k: _describe(v) for k, v in params.items()}, f, indent=1)
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        self.evict(keep=key)
+
+    def call(self, func, *args, **kwargs):
+        # func(*args, **kwargs), from the cache when it has been run before;
+        # returns the tree sequence and its key
+        key = call_key(func, *args, **kwargs)
+        mts = self.lookup(key)
+        if mts is None:
+            mts = func(*args, **kwargs)
+            bound = inspect.signature(func).bind(*args, **kwargs)
+            bound.apply_defaults()
+            self.store(key, mts, {"function": _function_name(func), **bound.arguments})
+        return mts, key
+
+    def artifact(self, key, suffixes, writer):
+        # Paths of files derived from an entry, written by writer(prefix) into
+        # the entry (as prefix + suffix for each suffix) the first time
+        entry = self.entry_dir(key)
+        paths = [os.path.join(entry, "result" + suffix) for suffix in suffixes]
+        if not all(os.path.exists(path) for path in paths):
+            tmp_prefix = os.path.join(entry, f"tmp{os.getpid()}_result")
+            writer(tmp_prefix)
+            for suffix, path in zip(suffixes, paths):
+                os.replace(tmp_prefix + suffix, path)
+            self.evict(keep=key)
+        self._touch(key)
+        return paths
+
+    def evict(self, keep=None):
+        # Drop least recently used entries until the cache fits in max_bytes
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.is_dir() and not entry.name.endswith(".tmp"):
+                    try:
+                        entries.append((entry.stat().st_mtime, _entry_size(entry.path), entry.name, entry.path))
+                    except FileNotFoundError:
+                        continue
+        total = sum(size for _, size, _, _ in entries)
+        for _, size, name, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+        return total
+
+
+# Linux ioctl that makes dst share src's blocks copy-on-write (btrfs, XFS)
+_FICLONE = 0x40049409
+
+
+def copy_file(src, dst):
+    # An independent copy, so editing an output in place (bgzip, appending to
+    # the VCF) cannot change the cache entry; a reflink where the file system
+    # supports one, else a byte copy
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        import fcntl
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+    except (ImportError, OSError):
+        shutil.copyfile(src, dst)
+
+
+def export_cached(cache, key, mts, name, formats, genotype_format="vcf", positions=None, rates=None,
+                  contig_id="1"):
+    # export.export_outputs for a cached result: trees, genotypes and .argn are
+    # made once per entry and copied to name + suffix, the rate CSV is written
+    # directly. Returns {format: seconds} for the exports that had to run.
+    suffixes = {"trees": (".trees",), "argn": (".argn",)}
+    if "genotypes" in formats:
+        suffixes["genotypes"] = export.genotype_suffixes(genotype_format)
+    timings = {}
+    for fmt in formats:
+        if fmt == "csv":
+            timings.update(export.export_outputs(mts, name, ["csv"], positions=positions, rates=rates))
+            continue
+        if fmt not in suffixes:
+            raise ValueError(f"Unknown output format: {fmt}")
+        if fmt == "trees":
+            paths = [os.path.join(cache.entry_dir(key), TREES_FILE)]
+        else:
+            # Genotype files carry the contig, so they are cached per contig
+            tag = f"_{contig_id}" if fmt == "genotypes" else ""
+            cached = [tag + suffix for suffix in suffixes[fmt]]
+
+            def writer(prefix, fmt=fmt, tag=tag):
+                timings.update(export.export_outputs(mts, prefix + tag, [fmt], genotype_format,
+                                                     contig_id=contig_id))
+
+            paths = cache.artifact(key, cached, writer)
+        for suffix, path in zip(suffixes[fmt], paths):
+            copy_file(path, name + suffix)
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or trim the simulation result cache')
+    parser.add_argument("-c", '--cache-dir', dest="cache_dir", default=DEFAULT_CACHE_DIR, help="Cache directory")
+    parser.add_argument("-m", '--max-size', dest="max_size", type=parse_size, default=DEFAULT_MAX_BYTES,
+                        help="Size cap, e.g. 500M or 20G; least recently used entries are evicted beyond it")
+    args = parser.parse_args()
+
+    total = SimulationCache(args.cache_dir, args.max_size).evict()
+    print(f"{args.cache_dir}: {total / (1 << 30):.2f} GiB after eviction")
@@ -1,38 +1,16 @@
 import csv
+import os
+import sys
 
-def create_map_from_csv(csv_file, map_file):
-    # Initialize lists to store positions and rates
-    positions = []
-    rates = []
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import genetic_map
 
-    # Read positions and rates from the CSV file
-    with open(csv_file, 'r') as csvfile:
-        reader = csv.reader(csvfile)
-        next(reader)  # Skip header
-        for row in reader:
-            position = float(row[0])
-            rate = float(row[1])
-            positions.append(position)
-            rates.append(rate)
-    
-    # Calculate genetic positions based on rates
-    genetic_positions = [0]  # The first genetic position is set to 0
-    cumulative_distance = 0
-    for i in range(1, len(positions)):
-        physical_distance = positions[i] - positions[i - 1]
-        rate = rates[i - 1]
-        genetic_distance = rate * physical_distance * 100
-        cumulative_distance += genetic_distance
-        genetic_positions.append(round(cumulative_distance,6))
+def create_map_from_csv(csv_file, map_file):
+    # Read positions and rates from the CSV file in one pass
+    positions, rates = genetic_map.read_rate_csv(csv_file)
     
-    # Write the map file
-    with open(map_file, 'w') as mapfile:
-        for pos, gmap in zip(positions, genetic_positions):
-            chromosome = 22
-            snp_id = "."
-            genetic_distance = gmap
-            physical_position = pos
-            mapfile.write(f"{chromosome}\t{snp_id}\t{genetic_distance}\t{physical_position}\n")
+    # Cumulative genetic positions, written as a map in one call
+    genetic_map.write_map_outputs(positions, rates, map_file=map_file)
 
 if __name__ == "__main__":
     csv_file = "wrongmap4.csv"
@@ -4,93 +4,64 @@ import pandas as pd
 import argparse
 import gzip
 import csv
+import hashlib
 import random
 import arg_needle_lib
+import os
+import sys
+import tskit
 
-def create_rate_map20Mb(map_file, convert_map_file, output_prefix, stage_number, seed=None):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import genetic_map
+import export
+import sim_cache
+
+WINDOW_LENGTH = 20_000_000
+
+
+def rate_map20Mb(map_file, seed=None):
+    # Random 20Mb window of the map, padded to exactly 20Mb at 2e-08; returns
+    # the map and the window bounds in the source
     if seed is not None:
         random.seed(seed)
     
-    # Read the HapMap format recombination map
-    rate_map = msprime.RateMap.read_hapmap(convert_map_file,rate_col=None, )
+    # Read the recombination map from the compiled cache of the PLINK map
+    rate_map = genetic_map.rate_map_from_plink_cm(map_file)
     
-    # Randomly select a 10Mb segment
-    total_length = rate_map.right[-1] - rate_map.right[0]
-    if total_length < 20_000_000:
-        raise ValueError("Not enough data for a 20Mb segment.")
-    
-    #print(total_length)
-    max_start_position = rate_map.right[-1] - 20_000_000
-    
-    #print(max_start_position)
-    start_position = random.choice([x for x in rate_map.left if rate_map.right[0] < x < max_start_position])
-    end_position = max((x for x in rate_map.right if x < start_position + 20_000_000), default=None)
+    # Randomly select a 20Mb segment by binary search over the interval edges
+    start_position, end_position = genetic_map.rate_map_window(rate_map, WINDOW_LENGTH)
 
     # Slice the map to get the 20Mb segment
     sliced_rate_map = rate_map.slice(start_position, end_position, trim = True)
 
-    new_left = [sliced_rate_map.right[-1], 20_000_000]
+    new_left = [sliced_rate_map.right[-1], WINDOW_LENGTH]
     new_position = np.append(sliced_rate_map.left, new_left)
 
     new_rate = np.append(sliced_rate_map.rate, 2e-08) 
 
     new_rate_map = msprime.RateMap(position = new_position, rate = new_rate)
+    return new_rate_map, start_position, end_position
 
-    csv_filename = f"{output_prefix}_stage{stage_number}.csv"
-    with open(csv_filename, "w", newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        # Write header
-        writer.writerow(["Position", "Rate"])
-        # Write data rows
-        for pos, rate in zip(new_rate_map.left, new_rate_map.rate):
-            writer.writerow([pos, rate])
-    
-    # Calculate genetic positions based on rates
-    genetic_positions = [0]
-    cumulative_distance = 0
-    for i in range(0, len(new_rate_map.left)):
-        physical_distance = new_rate_map.span[i]
-        rate = new_rate_map.rate[i]
-        genetic_distance = rate * physical_distance * 100
-        cumulative_distance += genetic_distance
-        genetic_positions.append(round(cumulative_distance, 6))
-    
-    filtered_rows = []
-    with open(map_file, 'r') as infile:
-        # Read the file line by line
-        for line in infile:
-            # Split the line into columns based on tab or space
-            columns = line.split()
-        
-            if len(columns) >= 4:
-                value = float(columns[3])
-                        
-                # Check if the value falls within the specified range
-                if start_position <= value <= end_position:
-                    filtered_rows.append(line)
+def write_stage_maps(map_file, rate_map, start_position, end_position, output_prefix, stage_number):
+    # Rate CSV and the map for threads from the extended rates
+    genetic_map.write_map_outputs(rate_map.left, rate_map.rate,
+                                  csv_file=f"{output_prefix}_stage{stage_number}.csv",
+                                  thread_map_file=f'{output_prefix}_stage{stage_number}_forthread.map')
     
+    # Slice the source map rows inside the window from the cached arrays
+    positions, gmaps = genetic_map.load_map_arrays(map_file, "plink")
+    window = genetic_map.window_slice(positions, start_position, end_position)
     map_filename = f'{output_prefix}_stage{stage_number}.map'
-    # Write the filtered rows to the output file
-    with open(map_filename, 'w') as outfile:
-        outfile.writelines(filtered_rows) 
-    
-    thread_map_filename = f'{output_prefix}_stage{stage_number}_forthread.map'
-    # Write the map file for thread
-    with open(thread_map_filename, 'w') as mapfile:
-        for pos, gmap in zip(new_rate_map.left, genetic_positions):
-            chromosome = 22
-            snp_id = f"."
-            genetic_distance = gmap
-            physical_position = pos
-            mapfile.write(f"{chromosome}\t{snp_id}\t{genetic_distance}\t{physical_position}\n")
-    
-    return new_rate_map
+    genetic_map.write_plink_window(map_file, map_filename, window)
 
-def export_vcf(mts, name):
-    # Output VCF (Variant Call Format) file
-    vcf_file = name + ".vcf"
-    with open(vcf_file, "w") as vcf_out:
-        mts.write_vcf(vcf_out)
+def create_rate_map20Mb(map_file, output_prefix, stage_number, seed=None):
+    rate_map, start_position, end_position = rate_map20Mb(map_file, seed)
+    write_stage_maps(map_file, rate_map, start_position, end_position, output_prefix, stage_number)
+    return rate_map
+
+def export_vcf(mts, name, genotype_format="vcf"):
+    # Output genotypes: plain VCF, BGZF-compressed VCF or PLINK2 pgen
+    export.write_genotypes(mts, name, genotype_format)
 
     arg = arg_needle_lib.tskit_to_arg(mts)
     arg_needle_lib.serialize_arg(arg, name + ".argn")
@@ -132,33 +103,117 @@ def sim_epoch(pop_size, sample_size, rate_map, mu_rate, start_time, end_time, in
     
     return mts
 
-if __name__ == '__main__':
-    seed = 123
-    pop_size = 10000
-    sample_size = 500
-    mu_rate = 1e-8  # Mutation rate per base pair per generation
-    map_file = 'plink.chr22.GRCh38.map'
-    convert_map_file = 'chr22_transform.map'
-    output_prefix = f'constant_chr22_500_Ne10000'
-
-    print("Creating rate map for first epoch...")
-    rate_map1 = create_rate_map20Mb(map_file, convert_map_file, output_prefix, 1, seed=seed)
-    
-    print("Running the simulation for generations 1 to 5000...")
-    mts1 = sim_epoch(pop_size, sample_size, rate_map1, mu_rate, start_time=0, end_time=5000, initial_state=None, seed=seed)
+# Stage checkpoints: each finished epoch's tree sequence and rate map are
+# stored under a key that chains the settings of that epoch and of every epoch
+# before it. A rerun loads the last stored stage and simulates only the rest, so
+# later epochs can be varied without re-running the earlier ones.
 
-    print("Creating rate map for second epoch...")
-    rate_map2 = create_rate_map20Mb(map_file, convert_map_file, output_prefix, 2, seed=seed+1)
-    
-    print("Running the simulation for generations 5000 to 10000...")
-    mts2 = sim_epoch(pop_size, sample_size, rate_map2, mu_rate, start_time=5000, end_time=10000, initial_state=mts1, seed=seed+1)
+def stage_key(parent_key, map_digest, pop_size, sample_size, mu_rate, start_time, end_time, seed):
+    h = hashlib.sha1(parent_key.encode())
+    h.update(repr((map_digest, WINDOW_LENGTH, pop_size, sample_size, mu_rate, start_time, end_time,
+                   seed)).encode())
+    return h.hexdigest()[:16]
+
+def checkpoint_files(checkpoint_dir, stage_number, key):
+    base = os.path.join(checkpoint_dir, f"stage{stage_number}_{key}")
+    return base + ".trees", base + ".npz"
+
+def save_stage(checkpoint_dir, stage_number, key, mts, rate_map, start_position, end_position):
+    # Rate map first, tree sequence last: the stage counts as finished once both exist
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    trees_file, rates_file = checkpoint_files(checkpoint_dir, stage_number, key)
+    tmp_file = f"{rates_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        np.savez(f, position=rate_map.position, rate=rate_map.rate,
+                 window=np.array([start_position, end_position], dtype=np.float64))
+    os.replace(tmp_file, rates_file)
+    tmp_file = f"{trees_file}.{os.getpid()}.tmp"
+    mts.dump(tmp_file)
+    os.replace(tmp_file, trees_file)
+
+def stage_finished(checkpoint_dir, stage_number, key):
+    return all(os.path.exists(f) for f in checkpoint_files(checkpoint_dir, stage_number, key))
+
+def load_stage_map(checkpoint_dir, stage_number, key):
+    _, rates_file = checkpoint_files(checkpoint_dir, stage_number, key)
+    with np.load(rates_file) as data:
+        start_position, end_position = data["window"]
+        return msprime.RateMap(position=data["position"], rate=data["rate"]), start_position, end_position
+
+def run_epochs(map_file, output_prefix, epochs, sample_size, mu_rate, seed, checkpoint_dir=".epoch_checkpoints",
+               cache=None):
+    # epochs: (pop_size, start_time, end_time) per stage, stage i seeded with seed + i;
+    # stages without a checkpoint are taken from the result cache when one is given
+    digest = genetic_map.file_digest(map_file)
+    keys = []
+    key = ""
+    for i, (pop_size, start_time, end_time) in enumerate(epochs):
+        key = stage_key(key, digest, pop_size, sample_size, mu_rate, start_time, end_time, seed + i)
+        keys.append(key)
+    resume = max((i for i, key in enumerate(keys) if stage_finished(checkpoint_dir, i + 1, key)), default=-1)
+
+    mts = None
+    for i, ((pop_size, start_time, end_time), key) in enumerate(zip(epochs, keys)):
+        stage_number = i + 1
+        if i <= resume:
+            if stage_finished(checkpoint_dir, stage_number, key):
+                rate_map, start_position, end_position = load_stage_map(checkpoint_dir, stage_number, key)
+            else:
+                # Only the stages after it are needed to resume; redraw the map
+                rate_map, start_position, end_position = rate_map20Mb(map_file, seed=seed + i)
+            if i == resume:
+                trees_file, _ = checkpoint_files(checkpoint_dir, stage_number, key)
+                print(f"Resuming after stage {stage_number} from {trees_file}")
+                mts = tskit.load(trees_file)
+        else:
+            print(f"Creating rate map for stage {stage_number}...")
+            rate_map, start_position, end_position = rate_map20Mb(map_file, seed=seed + i)
+            print(f"Running the simulation for generations {start_time} to {'' if end_time is None else end_time}...")
+            if cache is not None:
+                mts, _ = cache.call(sim_epoch, pop_size, sample_size, rate_map, mu_rate, start_time=start_time,
+                                    end_time=end_time, initial_state=mts, seed=seed + i)
+            else:
+                mts = sim_epoch(pop_size, sample_size, rate_map, mu_rate, start_time=start_time, end_time=end_time,
+                                initial_state=mts, seed=seed + i)
+            save_stage(checkpoint_dir, stage_number, key, mts, rate_map, start_position, end_position)
+        write_stage_maps(map_file, rate_map, start_position, end_position, output_prefix, stage_number)
+    return mts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Multi-epoch simulation with a new 20Mb rate map per epoch')
+    parser.add_argument("-m", '--map', dest="map_file", default='plink.chr22.GRCh38.map',
+                        help="Path to the PLINK map")
+    parser.add_argument("-s", '--sample', dest="sample_size", type=int, default=500, help="Diploid sample size")
+    parser.add_argument("-p", '--pop', dest="pop_sizes", type=genetic_map.int_list, default=[10000],
+                        help="Effective population size, or comma-separated sizes per epoch")
+    parser.add_argument("-e", '--epochs', dest="epoch_ends", type=genetic_map.int_list, default=[5000, 10000],
+                        help="Comma-separated generations at which the epochs end; the last epoch is unbounded")
+    parser.add_argument("-mu", '--mutation', dest="mu_rate", type=float, default=1e-8,
+                        help="Mutation rate per base pair per generation")
+    parser.add_argument('--seed', dest="seed", type=int, default=123, help="Seed of the first epoch")
+    parser.add_argument("-g", '--genotypes', dest="genotypes", default="vcf", choices=export.GENOTYPE_FORMATS,
+                        help="Genotype output format")
+    parser.add_argument('--checkpoint-dir', dest="checkpoint_dir", default=".epoch_checkpoints",
+                        help="Directory of the per-stage checkpoints")
+    parser.add_argument('--cache-dir', dest="cache_dir", default=None,
+                        help="Also look up and store the epoch simulations in this result cache")
+    parser.add_argument('--cache-size', dest="cache_size", type=sim_cache.parse_size,
+                        default=sim_cache.DEFAULT_MAX_BYTES, help="Size cap of the result cache, e.g. 20G")
+    parser.add_argument("-o", '--output', dest="output_prefix", default='constant_chr22_500_Ne10000',
+                        help="Output file prefix")
+    args = parser.parse_args()
 
-    print("Creating rate map for third epoch...")
-    rate_map3 = create_rate_map20Mb(map_file, convert_map_file, output_prefix, 3, seed=seed+2)
+    starts = [0] + args.epoch_ends
+    ends = args.epoch_ends + [None]
+    pop_sizes = args.pop_sizes * len(starts) if len(args.pop_sizes) == 1 else args.pop_sizes
+    if len(pop_sizes) != len(starts):
+        parser.error(f"Expected 1 or {len(starts)} population sizes")
+    epochs = list(zip(pop_sizes, starts, ends))
 
-    print("Running the simulation for generations 10000 to ...")
-    mts3 = sim_epoch(pop_size, sample_size, rate_map3, mu_rate, start_time=10000, end_time=None, initial_state=mts2, seed=seed+2)
+    cache = None if args.cache_dir is None else sim_cache.SimulationCache(args.cache_dir, args.cache_size)
+    mts = run_epochs(args.map_file, args.output_prefix, epochs, args.sample_size, args.mu_rate, args.seed,
+                     args.checkpoint_dir, cache)
     
     print("Exporting VCF...")
-    export_vcf(mts3, output_prefix)
-    print("Done!")
\ No newline at end of file
+    export_vcf(mts, args.output_prefix, args.genotypes)
+    print("Done!")
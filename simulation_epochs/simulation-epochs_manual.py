@@ -6,80 +6,32 @@ import gzip
 import csv
 import random
 import arg_needle_lib
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import export
+import synthetic_map
 
 def create_recombination_rate_csv(output_prefix, stage_number, step=2000, seed = None):
-    if seed is not None:
-        random.seed(seed)
-    
     # Define the regions and gaps
     regions = [
         (0, 20_000_000, 2e-08),
     ]
     gaps = [ ]
 
-    positions_and_rates = []
-
-    # Write regions with constant recombination rates and noise
-    for start, end, rate in regions:
-        current_position = start
-        while current_position <= end:
-            # Introduce noise: ±5% of the rate
-            noise = rate * random.uniform(-0.05, 0.05)
-            noisy_rate = rate + noise
-            positions_and_rates.append((current_position, noisy_rate))
-            current_position += step  # Increment by step size
-
-    # Write gaps with zero recombination rate
-    for start, end in gaps:
-        current_position = start
-        while current_position < end:
-            positions_and_rates.append((current_position, 0))
-            current_position += step  # Increment by step size
-
-    # Sort positions and rates by position
-    positions_and_rates.sort()
-
-    # Write sorted positions and rates to CSV
-    csv_filename = f"{output_prefix}_stage{stage_number}.csv"
-    with open(csv_filename, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["Position", "Rate"])
-        writer.writerows(positions_and_rates)
-
-    positions, rates = zip(*positions_and_rates)
-
-    rate_map = msprime.RateMap(
-        position=positions,
-        rate=rates[:-1],
-    )
-
-    # Calculate genetic positions based on rates
-    genetic_positions = [0]  # The first genetic position is set to 0
-    cumulative_distance = 0
-    for i in range(1, len(positions)):
-        physical_distance = positions[i] - positions[i - 1]
-        rate = rates[i - 1]
-        genetic_distance = rate * physical_distance * 100
-        cumulative_distance += genetic_distance
-        genetic_positions.append(round(cumulative_distance,6))
-    
-    # Write the map file
-    map_filename = f'{output_prefix}_stage{stage_number}.map'
-    with open(map_filename, 'w') as mapfile:
-        for pos, gmap in zip(positions, genetic_positions):
-            chromosome = 22
-            snp_id = "."
-            genetic_distance = gmap
-            physical_position = pos
-            mapfile.write(f"{chromosome}\t{snp_id}\t{genetic_distance}\t{physical_position}\n")
+    # Constant rate with ±5% noise every step bp, up to and including the end
+    positions, rates = synthetic_map.stepped_rates(regions, gaps, step, noise=0.05, rng=random.Random(seed),
+                                                   include_end=True)
+    synthetic_map.write_synthetic_map(f"{output_prefix}_stage{stage_number}.csv",
+                                      f'{output_prefix}_stage{stage_number}.map',
+                                      positions, rates, scale=100, integer_gaps=True)
 
-    return rate_map
+    return synthetic_map.synthetic_rate_map(positions, rates)
 
-def export_vcf(mts, name):
-    # Output VCF (Variant Call Format) file
-    vcf_file = name + ".vcf"
-    with open(vcf_file, "w") as vcf_out:
-        mts.write_vcf(vcf_out)
+def export_vcf(mts, name, genotype_format="vcf"):
+    # Output genotypes: plain VCF, BGZF-compressed VCF or PLINK2 pgen
+    export.write_genotypes(mts, name, genotype_format)
 
     arg = arg_needle_lib.tskit_to_arg(mts)
     arg_needle_lib.serialize_arg(arg, name + ".argn")
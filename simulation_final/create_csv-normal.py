@@ -7,6 +7,11 @@ import csv
 import random
 import os
 import arg_needle_lib
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import export
+import synthetic_map
 
 def create_recombination_rate_csv(output_csv, map_file, step=2000):
     # Define the regions and gaps
@@ -23,72 +28,15 @@ def create_recombination_rate_csv(output_csv, map_file, step=2000):
     gaps = [(3_000_001, 3_500_000), (5_500_001, 6_000_000), (8_000_001, 8_500_000), (10_500_001, 1_100_000),
             (13_000_001, 13_500_000), (15_500_001, 16_000_000), (18_000_001, 18_500_000), ]
 
-    # Initialize arrays to store x and y values
-    x = []
-    y = []
-
-# Generate y values based on normal distributions in each region
-    for start, end, peak in regions:
-        mu = peak
-        sigma = peak * 0.5
-        y_values = np.linspace(0, 2*mu, 1000)
-        x_values = np.linspace(start, end, 1000)
-        pdf_values = (1/(sigma * np.sqrt(2 * np.pi))) * np.exp(-((y_values - mu)**2) / (2 * sigma**2))/1e16
-        x.extend(x_values.tolist())
-        y.extend(pdf_values.tolist())
-
-    # Set y values to zero in the gaps
-    for gap_start, gap_end in gaps:
-        x_values = np.linspace(gap_start, gap_end, 1000)
-        y_values = np.zeros_like(x_values)
-        x.extend(x_values.tolist())
-        y.extend(y_values.tolist())
-
-    # Combine x and y into positions_and_rates list
-    positions_and_rates = [(x[i], y[i]) for i in range(len(x))]
-
-    # Sort positions_and_rates by position (x values)
-    positions_and_rates.sort()
-
-    positions, rates = zip(*positions_and_rates)
-
-    # Write sorted positions and rates to CSV
-    with open(output_csv, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["Position", "Rate"])
-        writer.writerows(positions_and_rates)
-
-    rate_map = msprime.RateMap(
-        position=positions,
-        rate=rates[:-1],
-    )
-
-    # Calculate genetic positions based on rates
-    genetic_positions = [0]  # The first genetic position is set to 0
-    cumulative_distance = 0
-    for i in range(1, len(positions)):
-        physical_distance = positions[i] - positions[i - 1]
-        rate = rates[i - 1]
-        genetic_distance = rate * physical_distance
-        cumulative_distance += genetic_distance
-        genetic_positions.append(round(cumulative_distance,6))
-    
-    # Write the map file
-    with open(map_file, 'w') as mapfile:
-        for pos, gmap in zip(positions, genetic_positions):
-            chromosome = 22
-            snp_id = "."
-            genetic_distance = gmap
-            physical_position = pos
-            mapfile.write(f"{chromosome}\t{snp_id}\t{genetic_distance}\t{physical_position}\n")
+    # Rates following a normal density across each region, zero in the gaps
+    positions, rates = synthetic_map.normal_rates(regions, gaps, points=1000)
+    synthetic_map.write_synthetic_map(output_csv, map_file, positions, rates, scale=1)
 
-    return rate_map
+    return synthetic_map.synthetic_rate_map(positions, rates)
 
-def export_vcf(mts, name):
-    # Output VCF (Variant Call Format) file
-    vcf_file = name + ".vcf"
-    with open(vcf_file, "w") as vcf_out:
-        mts.write_vcf(vcf_out)
+def export_vcf(mts, name, genotype_format="vcf"):
+    # Output genotypes: plain VCF, BGZF-compressed VCF or PLINK2 pgen
+    export.write_genotypes(mts, name, genotype_format)
 
     arg = arg_needle_lib.tskit_to_arg(mts)
     arg_needle_lib.serialize_arg(arg, name + ".argn")
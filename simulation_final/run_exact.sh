@@ -1,17 +1,16 @@
 #!/bin/bash
 
-# Loop through sample sizes from 50 to 500 in steps of 50
+# Collect input and output names for sample sizes from 25 to 500 in steps of 25
+trees_files=()
+nodes_output_files=()
 for sample_size in {25..500..25}
 do
-    # Define input file and output file names based on the sample size
-    argn_output_file="chr22_${sample_size}_Ne10000.argn"
-    nodes_output_file="exactARG_nodes_${sample_size}_Ne10000"
-
-    # Run the Python script to get recombination nodes
-    python3 get_recombination_nodes.py -a "$argn_output_file" -o "$nodes_output_file"
-
-    # Print a message indicating the completion of the current sample size
-    echo "Completed processing for sample size ${sample_size}"
+    trees_files+=("chr22_${sample_size}_Ne10000.trees")
+    nodes_output_files+=("exactARG_nodes_${sample_size}_Ne10000")
 done
 
-echo "All processing runs completed!"
\ No newline at end of file
+# Get recombination nodes for every sample size in one Python process, using all cores.
+# Inputs whose outputs are already up to date are skipped.
+python3 get_recombination_nodes.py -a "${trees_files[@]}" -o "${nodes_output_files[@]}"
+
+echo "All processing runs completed!"
@@ -1,5 +1,8 @@
 #!/bin/bash
 
+argn_output_files=()
+nodes_output_files=()
+
 # Loop through sample sizes from 50 to 500 in steps of 50
 for sample_size in {25..500..25}
 do
@@ -15,11 +18,14 @@ do
     # Convert the threads output to ARGN format
     threads convert --threads "$infer_output_file" --argn "$argn_output_file"
 
-    # Run the Python script to get recombination nodes
-    python3 get_recombination_nodes.py -a "$argn_output_file" -o "$nodes_output_file"
+    argn_output_files+=("$argn_output_file")
+    nodes_output_files+=("$nodes_output_file")
 
     # Print a message indicating the completion of the current sample size
-    echo "Completed processing for sample size ${sample_size}"
+    echo "Completed inference for sample size ${sample_size}"
 done
 
+# Get recombination nodes for every inferred ARG in one Python process, using all cores
+python3 get_recombination_nodes.py -a "${argn_output_files[@]}" -o "${nodes_output_files[@]}"
+
 echo "All processing runs completed!"
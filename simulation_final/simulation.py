@@ -6,24 +6,21 @@ import gzip
 import csv
 import random
 import arg_needle_lib
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import genetic_map
+import export
 
 def create_rate_map10Mb(map_file, seed=None):
     if seed is not None:
         random.seed(seed)
     
-    # Initialize lists to store positions and rates
-    positions = [0]
-    gmaps = [0]
-
-    # Read positions from map.txt file
-    with open(map_file, 'r') as f:
-        for line in f:
-            if line.strip():  # Check if line is not empty
-                parts = line.split()
-                position = float(parts[3])  # Extract position (assuming it's the third column)
-                positions.append(position)
-                gmap = float(parts[2])
-                gmaps.append(gmap)
+    # Read positions and genetic positions from the compiled map cache
+    positions, gmaps = genetic_map.load_map_arrays(map_file, "plink")
+    positions = np.insert(positions, 0, 0)
+    gmaps = np.insert(gmaps, 0, 0)
     
     # Random 10Mb segment
     # Ensure there is enough data for a segment
@@ -35,79 +32,41 @@ def create_rate_map10Mb(map_file, seed=None):
     start_position = random.uniform(positions[0], max_start_position)
     end_position = start_position + 10_000_000
 
-    # Filter positions and rates to only include the middle 500kb
-    filtered_positions = []
-    filtered_gmaps = []
-    for pos, gmap in zip(positions, gmaps):
-        if start_position <= pos <= end_position:
-            filtered_positions.append(pos)
-            filtered_gmaps.append(gmap)
+    # Slice the positions inside the 10Mb window by binary search
+    window = genetic_map.window_slice(positions, start_position, end_position)
+    filtered_positions = positions[window]
+    filtered_gmaps = gmaps[window]
 
     # Normalize positions to ensure the first position is zero
-    normalized_positions = [pos - filtered_positions[0] for pos in filtered_positions]
+    normalized_positions = filtered_positions - filtered_positions[0]
 
-    # Calculate combination rates and record them
-    combined_rates = []
-    for i in range(1, len(normalized_positions)):
-        pos1 = normalized_positions[i - 1]
-        pos2 = normalized_positions[i]
-        gmap1 = filtered_gmaps[i - 1]
-        gmap2 = filtered_gmaps[i]
-        combination_rate = ((gmap2 - gmap1) / (pos2 - pos1))
-        combined_rates.append(combination_rate)
+    # Calculate combination rates from array differences
+    combined_rates = genetic_map.compute_rates(normalized_positions, filtered_gmaps, scale=1)
 
     rate_map = msprime.RateMap(
         position=normalized_positions,
         rate=combined_rates
     )
 
-    with open("10Mbrates_chr22_500_Ne10000.csv", "w", newline='') as csvfile:
-        writer = csv.writer(csvfile)
-    
-        # Write header
-        writer.writerow(["Position", "Rate"])
-    
-        # Write data rows
-        for i in range(len(normalized_positions) - 1):
-            writer.writerow([normalized_positions[i], combined_rates[i]])
-    
-    # Calculate genetic positions based on rates
-    genetic_positions = [0]  # The first genetic position is set to 0
-    cumulative_distance = 0
-    for i in range(1, len(normalized_positions)):
-        physical_distance = normalized_positions[i] - normalized_positions[i - 1]
-        rate = combined_rates[i - 1]
-        genetic_distance = rate * physical_distance
-        cumulative_distance += genetic_distance
-        genetic_positions.append(round(cumulative_distance, 6))
-    
-    with open("10Mbmap_chr22_500_Ne10000.map", "w") as mapfile:
-        for index, (pos, gmap) in enumerate(zip(filtered_positions, filtered_gmaps)):
-            chromosome = 22
-            snp_id = f"."
-            genetic_distance = gmap
-            physical_position = pos
-            mapfile.write(f"{chromosome}\t{snp_id}\t{genetic_distance}\t{physical_position}\n")
-    
-    # Write the map file
-    with open("10Mbmap_chr22_500_Ne10000_forthread.map", 'w') as mapfile:
-        for pos, gmap in zip(normalized_positions, genetic_positions):
-            chromosome = 22
-            snp_id = f"."
-            genetic_distance = gmap
-            physical_position = pos
-            mapfile.write(f"{chromosome}\t{snp_id}\t{genetic_distance}\t{physical_position}\n")
+    # Rate CSV, the source map rows in the window and the map for threads
+    genetic_map.write_map_outputs(normalized_positions, combined_rates,
+                                  csv_file="10Mbrates_chr22_500_Ne10000.csv",
+                                  map_file="10Mbmap_chr22_500_Ne10000.map",
+                                  thread_map_file="10Mbmap_chr22_500_Ne10000_forthread.map",
+                                  source_map=(filtered_positions, filtered_gmaps), scale=1)
     
     return rate_map
 
-def export_vcf(mts, name):
-    # Output VCF (Variant Call Format) file
-    vcf_file = name + ".vcf"
-    with open(vcf_file, "w") as vcf_out:
-        mts.write_vcf(vcf_out)
+def export_vcf(mts, name, genotype_format="vcf", argn=False):
+    # Output genotypes: plain VCF, BGZF-compressed VCF or PLINK2 pgen
+    export.write_genotypes(mts, name, genotype_format)
 
-    arg = arg_needle_lib.tskit_to_arg(mts)
-    arg_needle_lib.serialize_arg(arg, name + ".argn")
+    # The exact ARG is kept as a tree sequence; get_recombination_nodes.py reads
+    # .trees directly, so the .argn conversion is only done on request
+    mts.dump(name + ".trees")
+    if argn:
+        arg = arg_needle_lib.tskit_to_arg(mts)
+        arg_needle_lib.serialize_arg(arg, name + ".argn")
 
 
 def sim_one_const(pop_size, sample_size, rate_map, mu_rate, seed=None):
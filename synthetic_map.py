@@ -0,0 +1,120 @@
+import argparse
+import random
+
+import msprime
+import numpy as np
+import pandas as pd
+
+import genetic_map
+
+# Synthetic recombination maps described by regions of constant (noisy) rate
+# and zero-rate gaps. Positions, rates and the genetic map are built with
+# whole-array operations, so many random maps can be drawn per experiment.
+
+
+def stepped_rates(regions, gaps=(), step=2000, noise=0.05, rng=None, include_end=False):
+    # One point every `step` bp from each region start up to its end (inclusive
+    # with include_end), at the region rate times a uniform +-noise factor, and
+    # zero-rate points through the gaps. Regions are (start, end, rate) and gaps
+    # (start, end); an end before its start gives no points. A random.Random rng
+    # makes the same draws as the original per-point loops did with the random
+    # module, so maps seeded that way are reproduced; anything else seeds a
+    # NumPy Generator.
+    if isinstance(rng, random.Random):
+        def draw(n):
+            return np.array([rng.uniform(-noise, noise) for _ in range(n)])
+    else:
+        generator = np.random.default_rng(rng)
+
+        def draw(n):
+            return generator.uniform(-noise, noise, n)
+    positions = []
+    rates = []
+    for start, end, rate in regions:
+        pos = np.arange(start, end + 1 if include_end else end, step, dtype=np.int64)
+        positions.append(pos)
+        rates.append(rate + rate * draw(len(pos)))
+    for start, end in gaps:
+        pos = np.arange(start, end, step, dtype=np.int64)
+        positions.append(pos)
+        rates.append(np.zeros(len(pos)))
+    return _sorted_points(positions, rates)
+
+
+def normal_rates(regions, gaps=(), points=1000, spread=0.5, divisor=1e16):
+    # `points` evenly spaced positions per region whose rates trace a normal
+    # density with mean `peak` and sd spread * peak over [0, 2 * peak], divided
+    # by `divisor`; gaps get `points` zero-rate positions
+    positions = []
+    rates = []
+    for start, end, peak in regions:
+        sigma = peak * spread
+        y = np.linspace(0, 2 * peak, points)
+        positions.append(np.linspace(start, end, points))
+        rates.append((1 / (sigma * np.sqrt(2 * np.pi))) * np.exp(-((y - peak) ** 2) / (2 * sigma ** 2)) / divisor)
+    for start, end in gaps:
+        positions.append(np.linspace(start, end, points))
+        rates.append(np.zeros(points))
+    return _sorted_points(positions, rates)
+
+
+def _sorted_points(positions, rates):
+    # Sorted by position, then rate, as sorting (position, rate) tuples did
+    positions = np.concatenate(positions) if positions else np.empty(0)
+    rates = np.concatenate(rates) if rates else np.empty(0)
+    order = np.lexsort((rates, positions))
+    return positions[order], rates[order]
+
+
+def genetic_positions(positions, rates, scale=100, decimals=6):
+    # Running genetic position at each point, rate i applying up to point i + 1
+    # and rounded to `decimals` places; scale=100 turns Morgans into cM
+    return genetic_map.cumulative_map(positions, rates, scale, decimals)
+
+
+def synthetic_rate_map(positions, rates):
+    # The last point only closes the map
+    return msprime.RateMap(position=positions, rate=rates[:-1])
+
+
+def write_synthetic_map(csv_file, map_file, positions, rates, thread_map_file=None, scale=100, chromosome=22,
+                        integer_gaps=False):
+    # Position,Rate CSV plus the PLINK map (and optionally the same map for threads);
+    # returns the genetic positions. With integer_gaps the zero rates are written
+    # as "0", as the stepped-rate loops wrote their gaps, instead of "0.0".
+    if integer_gaps:
+        rates = [0 if rate == 0 else rate for rate in np.asarray(rates).tolist()]
+    return genetic_map.write_map_outputs(positions, rates, csv_file, map_file, thread_map_file, chromosome=chromosome,
+                                         scale=scale)
+
+
+def read_regions(regions_file):
+    # start,end,rate rows; rows with a zero rate are gaps
+    df = pd.read_csv(regions_file)
+    is_gap = df["rate"] == 0
+    regions = list(df.loc[~is_gap, ["start", "end", "rate"]].itertuples(index=False, name=None))
+    gaps = list(df.loc[is_gap, ["start", "end"]].itertuples(index=False, name=None))
+    return regions, gaps
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Draw random synthetic recombination maps from a region layout')
+    parser.add_argument("-r", '--regions', dest="regions_file", required=True,
+                        help="CSV with start,end,rate columns; zero-rate rows are gaps")
+    parser.add_argument("-n", '--number', dest="number", type=int, default=1, help="Number of maps to draw")
+    parser.add_argument('--step', dest="step", type=int, default=2000, help="Spacing of map points in bp")
+    parser.add_argument('--noise', dest="noise", type=float, default=0.05, help="Relative uniform noise on the rates")
+    parser.add_argument('--scale', dest="scale", type=float, default=100,
+                        help="Factor from rate * bp to map units (100 for cM)")
+    parser.add_argument('--seed', dest="seed", type=int, default=None,
+                        help="Root seed for the NumPy SeedSequence of the maps (not the random module's seeds "
+                             "of the original create_csv scripts)")
+    parser.add_argument("-o", '--output', dest="output", required=True,
+                        help="Output prefix; writes <prefix>_<i>.csv and <prefix>_<i>.map")
+    args = parser.parse_args()
+
+    regions, gaps = read_regions(args.regions_file)
+    for i, seed_seq in enumerate(np.random.SeedSequence(args.seed).spawn(args.number)):
+        positions, rates = stepped_rates(regions, gaps, args.step, args.noise, np.random.default_rng(seed_seq))
+        write_synthetic_map(f"{args.output}_{i}.csv", f"{args.output}_{i}.map", positions, rates, scale=args.scale,
+                            integer_gaps=True)
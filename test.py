@@ -5,60 +5,20 @@ import argparse
 import gzip
 import arg_needle_lib
 import csv
+import genetic_map
+import export
 def create_rate_map(map_file):
-    # Initialize lists to store positions and rates
-    positions = [0]
-    gmaps = [0]
-
-    # Read positions from map.txt file
-    with open(map_file, 'r') as f:
-        for line in f:
-            if line.strip():  # Check if line is not empty
-                parts = line.split()
-                position = float(parts[3])  # Extract position (assuming it's the fourth column)
-                positions.append(position)
-                gmap = float(parts[2])
-                gmaps.append(gmap)
-
-    # Calculate combination rates and record them
-    combined_rates = []
-    for i in range(1, len(positions)):
-        pos1 = positions[i - 1]
-        pos2 = positions[i]
-        gmap1 = gmaps[i - 1]
-        gmap2 = gmaps[i]
-        combination_rate = ((gmap2 - gmap1) / (pos2 - pos1)) * 1_000_000 * 1e-8
-        combined_rates.append(combination_rate)
-    
-    rate_map = msprime.RateMap(
-        position=positions,
-        rate=combined_rates
-    )
+    # Bulk-load the PLINK map and compute the rates with array differences
+    rate_map, positions, combined_rates = genetic_map.rate_map_from_plink(map_file)
 
     return rate_map, positions, combined_rates
 
 
-def export_output(mts, name, positions, combined_rates):
-    a = arg_needle_lib.tskit_to_arg(mts)
-    arg_needle_lib.serialize_arg(a, name + ".argn")
-
-    # Output Tree Sequence to a file
-    mts.dump(name + ".trees")
-
-    # Output VCF (Variant Call Format) file
-    vcf_file = name + ".vcf"
-    with open(vcf_file, "w") as vcf_out:
-        mts.write_vcf(vcf_out)
-    
-    with open(name + ".csv", "w", newline='') as csvfile:
-        writer = csv.writer(csvfile)
-    
-        # Write header
-        writer.writerow(["Position", "Rate"])
-    
-        # Write data rows
-        for i in range(len(positions) - 1):
-            writer.writerow([positions[i], combined_rates[i]])
+def export_output(mts, name, positions, combined_rates, genotype_format="vcf", formats=export.OUTPUT_FORMATS):
+    # Write the .argn, .trees, genotypes and Position,Rate CSV concurrently
+    timings = export.export_outputs(mts, name, formats, genotype_format, positions=positions, rates=combined_rates)
+    for fmt, seconds in timings.items():
+        print(f"Exported {fmt} in {seconds:.2f}s")
 
 
 def sim_one_const(pop_size, sample_size, rate_map, mu_rate):
@@ -83,6 +43,11 @@ if __name__ == '__main__':
     parser.add_argument("-mu", '--mutation', dest="mu_rate", required=True, help="Mutation rate")
     parser.add_argument("-m", '--map', dest="map_file", required=True, help="Path to the genetic map file")
     parser.add_argument("-o", '--output', dest="output", required=True, help="Output file prefix")
+    parser.add_argument("-g", '--genotypes', dest="genotype_format", default="vcf", choices=export.GENOTYPE_FORMATS,
+                        help="Genotype output: plain VCF, BGZF-compressed VCF or PLINK2 pgen/pvar/psam")
+    parser.add_argument("-f", '--formats', dest="formats", default="argn,trees,genotypes,csv",
+                        type=export.formats_type(export.OUTPUT_FORMATS),
+                        help="Comma-separated outputs to write, from: argn, trees, genotypes, csv")
     
     args = vars(parser.parse_args())
     print(args)
@@ -95,7 +60,7 @@ if __name__ == '__main__':
     
     rate_map, positions, combined_rates = create_rate_map(map_file)
     mts = sim_one_const(pop_size, sample_size, rate_map, mu_rate)
-    export_output(mts, args['output'],positions, combined_rates)
+    export_output(mts, args['output'],positions, combined_rates, args['genotype_format'], args['formats'])
 
 # bash script
 #!/bin/bash
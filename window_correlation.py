@@ -0,0 +1,215 @@
+import argparse
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+import genetic_map
+
+# Windowed correlations between an estimated and a true map, replacing the
+# spcor_window loops in for_ARG/corr.R and plots/corr_nonoverlap.R. Windows are
+# stacked into 2-D arrays and ranked or summed a block of rows at a time.
+
+# Upper bound on the number of values ranked at once
+_BLOCK_VALUES = 1 << 22
+
+
+def rank_rows(a):
+    # Average ranks (1-based, ties share their mean rank) along the last axis,
+    # as R's rank() and cor(method = "spearman") use
+    a = np.asarray(a, dtype=np.float64)
+    rows, width = a.shape
+    order = np.argsort(a, axis=1, kind="stable")
+    sorted_a = np.take_along_axis(a, order, axis=1)
+    # Number the runs of equal values, uniquely across rows
+    new_run = np.ones((rows, width), dtype=bool)
+    new_run[:, 1:] = sorted_a[:, 1:] != sorted_a[:, :-1]
+    run = np.cumsum(new_run.ravel()) - 1
+    position = np.tile(np.arange(1, width + 1, dtype=np.float64), rows)
+    mean_rank = np.bincount(run, weights=position) / np.bincount(run)
+    ranks = np.empty_like(sorted_a)
+    np.put_along_axis(ranks, order, mean_rank[run].reshape(rows, width), axis=1)
+    return ranks
+
+
+def pearson_rows(x, y):
+    # Pearson correlation of each row pair; NaN for rows with no variance
+    xc = x - x.mean(axis=1, keepdims=True)
+    yc = y - y.mean(axis=1, keepdims=True)
+    denom = np.sqrt((xc * xc).sum(axis=1) * (yc * yc).sum(axis=1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denom > 0, (xc * yc).sum(axis=1) / denom, np.nan)
+
+
+def spearman_rows(x, y):
+    return pearson_rows(rank_rows(x), rank_rows(y))
+
+
+def _complete_obs(x, y, method):
+    # One window with missing values, using only the complete pairs
+    keep = ~(np.isnan(x) | np.isnan(y))
+    if keep.sum() < 2:
+        return np.nan
+    return _ROW_METHODS[method](x[keep][None, :], y[keep][None, :])[0]
+
+
+_ROW_METHODS = {"spearman": spearman_rows, "pearson": pearson_rows}
+
+
+def _window_rows(x, y, window_size, overlap):
+    # Full-size windows as (windows, window_size) views, plus the ragged last
+    # block for non-overlapping windows
+    n = len(x)
+    if overlap:
+        if window_size > n:
+            return np.empty((0, window_size)), np.empty((0, window_size)), None
+        return sliding_window_view(x, window_size), sliding_window_view(y, window_size), None
+    full = n // window_size * window_size
+    tail = (x[full:], y[full:]) if full < n else None
+    return x[:full].reshape(-1, window_size), y[:full].reshape(-1, window_size), tail
+
+
+def window_correlations(x, y, window_size, overlap=False, method="spearman"):
+    # Correlation in every window of window_size consecutive values. Overlapping
+    # windows advance by one value (corr.R); non-overlapping ones tile the series
+    # with a shorter final window (corr_nonoverlap.R). Missing values are
+    # dropped pairwise within a window.
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) != len(y):
+        raise ValueError("x and y must have the same length")
+    if window_size < 1:
+        raise ValueError("window_size must be at least 1")
+    row_method = _ROW_METHODS[method]
+
+    xs, ys, tail = _window_rows(x, y, window_size, overlap)
+    missing = np.isnan(xs).any(axis=1) | np.isnan(ys).any(axis=1)
+    values = np.full(len(xs), np.nan)
+    block = max(1, _BLOCK_VALUES // window_size)
+    for lo in range(0, len(xs), block):
+        hi = min(lo + block, len(xs))
+        values[lo:hi] = row_method(xs[lo:hi], ys[lo:hi])
+    for i in np.flatnonzero(missing):
+        values[i] = _complete_obs(xs[i], ys[i], method)
+    if tail is not None:
+        values = np.append(values, _complete_obs(tail[0], tail[1], method))
+    return values
+
+
+def mean_window_correlation(x, y, window_size, overlap=False, method="spearman"):
+    values = window_correlations(x, y, window_size, overlap, method)
+    values = values[~np.isnan(values)]
+    return values.mean() if len(values) else np.nan
+
+
+def batch_mean_window_correlation(xs, y, window_size, overlap=False, method="spearman"):
+    # mean_window_correlation for many x series (rows of xs) against one y, for
+    # data without missing values. Rows are processed a few at a time so the
+    # stacked windows stay within _BLOCK_VALUES.
+    xs = np.atleast_2d(np.asarray(xs, dtype=np.float64))
+    y = np.asarray(y, dtype=np.float64)
+    row_method = _ROW_METHODS[method]
+    n = xs.shape[1]
+    if overlap:
+        num_windows = n - window_size + 1
+        if num_windows < 1:
+            return np.full(len(xs), np.nan)
+        y_rows = sliding_window_view(y, window_size)
+    else:
+        full = n // window_size * window_size
+        num_windows = full // window_size
+        y_rows = y[:full].reshape(-1, window_size)
+    means = np.empty(len(xs))
+    step = max(1, _BLOCK_VALUES // max(num_windows * window_size, 1))
+    for lo in range(0, len(xs), step):
+        batch = xs[lo:lo + step]
+        if overlap:
+            x_rows = sliding_window_view(batch, window_size, axis=1).reshape(-1, window_size)
+        else:
+            x_rows = batch[:, :full].reshape(-1, window_size)
+        values = row_method(x_rows, np.tile(y_rows, (len(batch), 1))).reshape(len(batch), -1)
+        if not overlap and n - full > 1:
+            # Ragged final window; a single value has no correlation
+            tail = row_method(batch[:, full:], np.tile(y[full:], (len(batch), 1)))
+            values = np.column_stack([values, tail])
+        with warnings.catch_warnings():
+            # All-NaN rows (constant windows only) average to NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            means[lo:lo + step] = np.nanmean(values, axis=1)
+    return means
+
+
+def total_correlation(x, y, method="spearman"):
+    return _complete_obs(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), method)
+
+
+def window_bins(window_sizes, interval_length):
+    # Window lengths in bp to whole numbers of bins, as jump <- ceiling(...) in R
+    return [max(1, int(np.ceil(size / interval_length))) for size in window_sizes]
+
+
+def window_label(size):
+    for unit, scale in (("Mb", 1_000_000), ("kb", 1_000)):
+        if size >= scale:
+            return f"{size / scale:g} {unit}"
+    return f"{size:g} bp"
+
+
+def correlation_table(x, y, window_sizes, interval_length, overlap=False, methods=("spearman", "pearson")):
+    # "Total" row followed by one row per window size, one column per method
+    rows = [{"Window_Size": "Total", "Window_Bins": len(x)}]
+    rows += [{"Window_Size": window_label(size), "Window_Bins": bins}
+             for size, bins in zip(window_sizes, window_bins(window_sizes, interval_length))]
+    for method in methods:
+        column = f"{method.capitalize()}_Correlation"
+        rows[0][column] = total_correlation(x, y, method)
+        for row in rows[1:]:
+            row[column] = mean_window_correlation(x, y, row["Window_Bins"], overlap, method)
+    return pd.DataFrame(rows)
+
+
+def interval_length_of(merged):
+    # Mean bin width of a merged table from rate_estimate.py or the R scripts
+    if "End" in merged:
+        return float((merged["End"] - merged["Start"]).mean())
+    return float(np.diff(merged["Start"].to_numpy()).mean())
+
+
+def correlation_table_from_file(merged_file, window_sizes, x_col="Density", y_col="Rate", overlap=False,
+                                methods=("spearman", "pearson")):
+    merged = pd.read_csv(merged_file)
+    return correlation_table(merged[x_col].to_numpy(), merged[y_col].to_numpy(), window_sizes,
+                             interval_length_of(merged), overlap, methods)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Windowed Spearman/Pearson correlation between estimated and true maps')
+    parser.add_argument("-i", '--input', dest="merged_files", nargs="+", required=True,
+                        help="Merged tables with Start, Density and Rate columns (e.g. from rate_estimate.py)")
+    parser.add_argument("-w", '--windows', dest="window_sizes", type=genetic_map.float_list,
+                        default=[10_000, 100_000, 1_000_000], help="Comma-separated window sizes in bp")
+    parser.add_argument('--overlap', action="store_true",
+                        help="Slide windows one bin at a time instead of tiling the map")
+    parser.add_argument("-x", dest="x_col", default="Density", help="Column of the estimated map")
+    parser.add_argument("-y", dest="y_col", default="Rate", help="Column of the true map")
+    parser.add_argument("-m", '--methods', dest="methods", default="spearman,pearson",
+                        help="Comma-separated correlation methods (spearman, pearson)")
+    parser.add_argument("-o", '--output', dest="output", default="spearman_correlation_results.csv",
+                        help="Output CSV")
+    args = parser.parse_args()
+
+    methods = [m.strip() for m in args.methods.split(",") if m.strip()]
+    for method in methods:
+        if method not in _ROW_METHODS:
+            parser.error(f"Unknown method: {method}")
+
+    tables = []
+    for merged_file in args.merged_files:
+        table = correlation_table_from_file(merged_file, args.window_sizes, args.x_col, args.y_col,
+                                            args.overlap, methods)
+        if len(args.merged_files) > 1:
+            table.insert(0, "File", os.path.basename(merged_file))
+        tables.append(table)
+    pd.concat(tables, ignore_index=True).to_csv(args.output, index=False)